@@ -0,0 +1,131 @@
+"""
+ADS Scanner
+
+Scan engine for the ADS1115s of one I2C bus: a background thread puts the converters in continuous
+mode at the chosen data rate and gain and cycles through every soil channel, keeping the latest
+conversions of each one. Soil sensors read their value from this buffer instead of waiting on the
+bus for a single-shot conversion, and a retry just waits for the next scan rather than converting
+again.
+
+The achieved samples per second of every channel are kept in `rates()` and exported as metrics.
+"""
+
+import threading
+import time
+from collections import deque
+from utils import printlog
+
+
+# Samples per second the ADS1115 supports, a conversion takes 1/data_rate seconds
+DATA_RATES = [8, 16, 32, 64, 128, 250, 475, 860]
+GAINS = [2 / 3, 1, 2, 4, 8, 16]
+RATE_WINDOW = 5     # seconds between samples per second updates
+
+
+class ADSScanner:
+
+
+    def __init__(self, adcs, channels, i2c_lock, data_rate=860, gain=1, scan_period=0.1, max_age=2.0,
+                 mode=None, history=16, metrics=None):
+        # adcs: the ADS1115 (or a list of them) on one bus, channels: name -> AnalogIn on one of them
+        if data_rate not in DATA_RATES:
+            raise ValueError(f"Unsupported ADS1115 data rate {data_rate}, expected one of {DATA_RATES}")
+        if gain not in GAINS:
+            raise ValueError(f"Unsupported ADS1115 gain {gain}, expected one of {GAINS}")
+        self.adcs = adcs if isinstance(adcs, (list, tuple)) else [adcs]
+        self.channels = dict(channels)
+        self.i2c_lock = i2c_lock
+        self.data_rate = data_rate
+        self.gain = gain
+        self.scan_period = scan_period
+        self.max_age = max_age
+        self.mode = mode
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        # Latest conversions of every channel, (voltage, monotonic time) newest last
+        self.samples = {name: deque(maxlen=history) for name in self.channels}
+        self.counts = {name: 0 for name in self.channels}
+        self.errors = {name: 0 for name in self.channels}
+        self.sample_rates = {name: 0.0 for name in self.channels}
+        self.stopped = threading.Event()
+        self.thread = None
+
+
+    def start(self):
+        with self.i2c_lock:
+            for ads in self.adcs:
+                ads.data_rate = self.data_rate
+                ads.gain = self.gain
+                if self.mode is not None:
+                    ads.mode = self.mode
+        self.thread = threading.Thread(target=self.run, name="ads-scanner", daemon=True)
+        self.thread.start()
+        printlog(f"ADS scan: {', '.join(self.channels)} at {self.data_rate} SPS, gain {self.gain}")
+        return self
+
+
+    def stop(self):
+        self.stopped.set()
+        if self.thread is not None:
+            self.thread.join()
+            self.thread = None
+
+
+    def scan(self):
+        # One conversion of every channel, the bus is released between channels for the light sensor
+        for name, channel in self.channels.items():
+            try:
+                with self.i2c_lock:
+                    voltage = channel.voltage
+            except (RuntimeError, OSError):
+                self.errors[name] += 1
+                continue
+            with self.lock:
+                self.samples[name].append((voltage, time.monotonic()))
+                self.counts[name] += 1
+
+
+    def run(self):
+        window_start = time.monotonic()
+        window_counts = dict(self.counts)
+        while not self.stopped.is_set():
+            started = time.monotonic()
+            self.scan()
+            if started - window_start >= RATE_WINDOW:
+                self.update_rates(started - window_start, window_counts)
+                window_start = started
+                window_counts = dict(self.counts)
+            self.stopped.wait(max(0, self.scan_period - (time.monotonic() - started)))
+
+
+    def update_rates(self, elapsed, window_counts):
+        with self.lock:
+            for name in self.channels:
+                self.sample_rates[name] = (self.counts[name] - window_counts[name]) / elapsed
+        if self.metrics is not None:
+            for name, rate in self.rates().items():
+                self.metrics.set_gauge("plant_ads_samples_per_second", "Conversions per second achieved by the ADS scan.",
+                                       round(rate, 2), name)
+
+
+    def rates(self):
+        with self.lock:
+            return dict(self.sample_rates)
+
+
+    def latest(self, name):
+        # Newest conversion of the channel, raises RuntimeError when there is none fresh enough to retry on
+        with self.lock:
+            samples = self.samples[name]
+            if not samples or time.monotonic() - samples[-1][1] > self.max_age:
+                raise RuntimeError(f"No ADS conversion of {name} in the last {self.max_age}s")
+            return samples[-1][0]
+
+
+    def mean(self, name, count=None):
+        # Mean of the buffered conversions of the channel, to smooth out noise
+        with self.lock:
+            voltages = [voltage for voltage, _ in list(self.samples[name])[-(count or len(self.samples[name])):]]
+        if not voltages:
+            raise RuntimeError(f"No ADS conversion of {name} yet")
+        return sum(voltages) / len(voltages)
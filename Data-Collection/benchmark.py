@@ -0,0 +1,218 @@
+"""
+Benchmark Script
+
+Times the package_data + log_rows cycle (write-ahead log included) against the simulated sensors and
+saves the results as JSON so they can be compared across versions. It reports cycle latency
+percentiles, rows written per second, bytes written per row and peak RSS, every scenario in its own
+interpreter so its peak RSS is its own, sweeping the number of plants (empty files) and the size
+of the existing data files (day, month and year of 30 minute readings). It also checks that importing
+data_collection stays under STARTUP_TARGET_MS without loading numpy or any hardware driver.
+
+Usage: python benchmark.py [--cycles 50] [--plants 2 16 64 256] [--output results.json]
+"""
+
+import argparse
+import contextlib
+import datetime
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+
+PLANT_COUNTS = [2, 16, 64, 256]
+FILE_SIZES = {"day": 48, "month": 48 * 30, "year": 48 * 365}
+RESULTS_DIR = os.path.join(os.path.dirname(os.path.abspath(__file__)), "Benchmark-Data")
+STARTUP_TARGET_MS = 100
+# Modules a plain import of data_collection must not pull in
+HEAVY_MODULES = ["numpy", "board", "busio", "adafruit_dht", "adafruit_bh1750", "adafruit_ads1x15", "sensor_manager"]
+
+TAXONOMY = {"plant_order": "Alismatales", "plant_family": "Araceae", "plant_subfamily": "Monsteroideae",
+            "plant_genus": "Spathiphylleae", "environment": "indoor"}
+
+
+def write_config(directory, plant_count, sim):
+    os.makedirs(os.path.join(directory, "Plant-Data"), exist_ok=True)
+    os.makedirs(os.path.join(directory, "Calibration-Data"), exist_ok=True)
+    plants = []
+    for number in range(1, plant_count + 1):
+        calibration_file = f"Calibration-Data/calibration_data_{number}.json"
+        with open(os.path.join(directory, calibration_file), 'w') as cal_file:
+            json.dump({"max_value": 3.78, "min_value": 1.97}, cal_file)
+        # Four channels per ADS1115, four ADS1115 per bus
+        plants.append(dict(TAXONOMY, plant_id=f"plant-{number}", channel=f"P{(number - 1) % 4}",
+                           ads_address=0x48 + (number - 1) // 4 % 4, bus=1 + (number - 1) // 16,
+                           calibration_file=calibration_file, csv_filename=f"Plant-Data/plant_data_{number}.csv"))
+    config = {"backend": "sim", "sim": sim, "soil_state_file": "Calibration-Data/soil_state.json", "plants": plants}
+    filename = os.path.join(directory, "bot_config.json")
+    with open(filename, 'w') as config_file:
+        json.dump(config, config_file)
+    return filename
+
+
+def prefill(data_collection, rows):
+    # Existing history in every plant file, written as one block
+    for plant in data_collection.plant_registry:
+        row = dict(data_collection.plant_row(plant, "2024-01-01", "00:00:00"),
+                   soil_moisture_percent=50.0, lux=100.0, temperature=21, humidity=55, was_watered=0, ml=0)
+        text = data_collection.data_writer.format_rows([None, row]).decode()
+        header, line = text.splitlines(keepends=True)
+        with open(plant.csv_filename, 'w', newline='') as file:
+            file.write(header + line * rows)
+
+
+def percentile(values, percent):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(percent / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+def run_scenario(data_collection, name, plant_count, prefill_rows, cycles, sim):
+    directory = tempfile.mkdtemp(prefix="plant-benchmark-")
+    try:
+        data_collection.start(write_config(directory, plant_count, sim))
+        registry = data_collection.plant_registry
+        prefill(data_collection, prefill_rows)
+        size_before = sum(os.path.getsize(plant.csv_filename) for plant in registry)
+
+        latencies = []
+        rows_written = 0
+        started = time.perf_counter()
+        with contextlib.redirect_stdout(io.StringIO()):
+            for _ in range(cycles):
+                cycle_start = time.perf_counter()
+                rows = data_collection.package_data()
+                if rows is not None:
+                    # The collection loop's own write path, write-ahead log first
+                    data_collection.log_rows(rows)
+                    rows_written += len(rows)
+                latencies.append(time.perf_counter() - cycle_start)
+            data_collection.data_writer.close()
+            elapsed = time.perf_counter() - started
+            data_collection.stop()
+
+        size_after = sum(os.path.getsize(plant.csv_filename) for plant in registry)
+        return {
+            "name": name,
+            "plants": plant_count,
+            "prefill_rows_per_plant": prefill_rows,
+            "cycles": cycles,
+            "rows_written": rows_written,
+            "cycle_latency_ms": {
+                "p50": percentile(latencies, 50) * 1000,
+                "p90": percentile(latencies, 90) * 1000,
+                "p99": percentile(latencies, 99) * 1000,
+                "max": max(latencies) * 1000,
+                "mean": sum(latencies) / len(latencies) * 1000,
+            },
+            "rows_per_second": rows_written / elapsed if elapsed else None,
+            "bytes_per_row": (size_after - size_before) / rows_written if rows_written else None,
+            # ru_maxrss is in KiB on Linux, the scenario has the process to itself
+            "peak_rss_kib": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss,
+        }
+    finally:
+        shutil.rmtree(directory, ignore_errors=True)
+
+
+def run_isolated(name, plant_count, prefill_rows, cycles, sim):
+    # Fresh interpreter per scenario, ru_maxrss only ever grows within one process
+    scenario = json.dumps([name, plant_count, prefill_rows, cycles, sim])
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), "--scenario", scenario], capture_output=True,
+                            text=True, check=True, cwd=os.path.dirname(os.path.abspath(__file__))).stdout
+    return json.loads(output.splitlines()[-1])
+
+
+def measure_startup(runs=5):
+    # Fresh interpreter every run, so nothing is cached in sys.modules
+    code = ("import sys, time; start = time.perf_counter(); import data_collection; "
+            "print((time.perf_counter() - start) * 1000); "
+            f"print(','.join(name for name in {HEAVY_MODULES!r} if name in sys.modules))")
+    times = []
+    loaded = set()
+    for _ in range(runs):
+        output = subprocess.run([sys.executable, "-c", code], capture_output=True, text=True, check=True,
+                                cwd=os.path.dirname(os.path.abspath(__file__))).stdout.splitlines()
+        times.append(float(output[0]))
+        if len(output) > 1:
+            loaded.update(name for name in output[1].split(",") if name)
+    median = sorted(times)[len(times) // 2]
+    return {"import_ms_median": median, "import_ms_runs": times, "target_ms": STARTUP_TARGET_MS,
+            "heavy_modules_loaded": sorted(loaded), "met": median <= STARTUP_TARGET_MS and not loaded}
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the collection cycle on simulated sensors")
+    parser.add_argument("--cycles", type=int, default=50)
+    parser.add_argument("--plants", type=int, nargs="+", default=PLANT_COUNTS)
+    parser.add_argument("--sizes", nargs="+", default=list(FILE_SIZES), choices=list(FILE_SIZES))
+    parser.add_argument("--latency", type=float, default=0.0, help="simulated seconds per sensor read")
+    parser.add_argument("--failure-rate", type=float, default=0.0, help="simulated read failure rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--output", help="JSON file, defaults to Benchmark-Data/benchmark_<time>.json")
+    # Used by run_isolated, runs one scenario and prints its results
+    parser.add_argument("--scenario", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.scenario is not None:
+        import data_collection
+        print(json.dumps(run_scenario(data_collection, *json.loads(args.scenario))))
+        return
+
+    sim = {"seed": args.seed, "latency": args.latency, "failure_rate": args.failure_rate}
+    print("Measuring startup...")
+    startup = measure_startup()
+    import data_collection
+
+    scenarios = []
+    for plant_count in args.plants:
+        print(f"Benchmarking {plant_count} plants...")
+        scenarios.append(run_isolated(f"plants-{plant_count}", plant_count, 0, args.cycles, sim))
+    for size in args.sizes:
+        print(f"Benchmarking {size}-sized files...")
+        scenarios.append(run_isolated(f"file-{size}", 2, FILE_SIZES[size], args.cycles, sim))
+
+    results = {
+        "created": datetime.datetime.now().isoformat(timespec="seconds"),
+        "commit": git_commit(),
+        "python": sys.version.split()[0],
+        "platform": platform.platform(),
+        "machine": platform.machine(),
+        "settings": {"cycles": args.cycles, "flush_rows": data_collection.FLUSH_ROWS,
+                     "fsync": data_collection.FSYNC, "wal": data_collection.WAL, "concurrent_reads": data_collection.CONCURRENT_READS,
+                     "sim": sim},
+        "startup": startup,
+        "scenarios": scenarios,
+    }
+    output = args.output
+    if output is None:
+        os.makedirs(RESULTS_DIR, exist_ok=True)
+        output = os.path.join(RESULTS_DIR, f"benchmark_{datetime.datetime.now():%Y%m%d-%H%M%S}.json")
+    with open(output, 'w') as results_file:
+        json.dump(results, results_file, indent=4)
+
+    for scenario in scenarios:
+        latency = scenario["cycle_latency_ms"]
+        print(f"{scenario['name']:>12}: p50 {latency['p50']:.2f} ms, p99 {latency['p99']:.2f} ms, "
+              f"{scenario['rows_per_second']:.0f} rows/s, {scenario['bytes_per_row']:.1f} B/row, "
+              f"peak RSS {scenario['peak_rss_kib']} KiB")
+    print(f"\nImport of data_collection: {startup['import_ms_median']:.1f} ms (target {STARTUP_TARGET_MS} ms), "
+          f"{'OK' if startup['met'] else 'MISSED'}")
+    print(f"Results saved to {output}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,245 @@
+"""
+Binary Log
+
+Alternative storage for log_data: fixed-width binary records appended to one file per plant instead
+of CSV text. A record is 32 bytes: epoch timestamp (float64), soil moisture, lux, temperature and
+humidity (float32, NaN when missing), ml (uint16), was_watered and missing-value flags (uint8) and
+an interned plant id (uint16). The plant id strings are kept once in a small `.ids` sidecar.
+
+BinaryLogReader memory-maps the file and exposes every column as a zero-copy NumPy view, so a
+year of readings loads instantly for training.
+"""
+
+import json
+import math
+import os
+import struct
+import time
+from utils import printlog, row_timestamp
+
+
+MAGIC = b"PLANTLOG"
+VERSION = 1
+HEADER = struct.Struct("<8sHH52x")
+RECORD = struct.Struct("<dffffHBBH2x")
+FLOAT_FIELDS = ["soil_moisture_percent", "lux", "temperature", "humidity"]
+
+# Flag bits, set when the reading was missing
+MISSING_SOIL = 1
+MISSING_LUX = 2
+MISSING_TEMPERATURE = 4
+MISSING_HUMIDITY = 8
+MISSING_WATERING = 16
+MISSING_FLAGS = [MISSING_SOIL, MISSING_LUX, MISSING_TEMPERATURE, MISSING_HUMIDITY]
+
+
+def record_dtype():
+    import numpy as np
+    return np.dtype([("timestamp", "<f8"), ("soil_moisture_percent", "<f4"), ("lux", "<f4"),
+                     ("temperature", "<f4"), ("humidity", "<f4"), ("ml", "<u2"), ("was_watered", "u1"),
+                     ("flags", "u1"), ("plant", "<u2"), ("reserved", "V2")])
+
+
+def load_plant_ids(filename):
+    try:
+        with open(filename + ".ids", 'r') as ids_file:
+            return json.load(ids_file)
+    except FileNotFoundError:
+        return []
+
+
+class BinaryLogWriter:
+
+
+    def __init__(self, flush_rows=20, flush_seconds=600, fsync=False):
+        # Same flush policy and interface as DataWriter
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.files = {}
+        self.buffers = {}
+        self.plant_ids = {}
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def open_file(self, filename, headers=None):
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        file = open(filename, 'ab')
+        size = file.tell()
+        if 0 < size < HEADER.size:
+            # Torn while the header was written, nothing after it yet
+            printlog(f"Repairing {filename}: rewriting a torn header of {size} bytes")
+            file.truncate(0)
+            size = 0
+        if size == 0:
+            file.write(HEADER.pack(MAGIC, VERSION, RECORD.size))
+            file.flush()
+        else:
+            with open(filename, 'rb') as existing:
+                magic, version, record_size = HEADER.unpack(existing.read(HEADER.size))
+            if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+                file.close()
+                raise ValueError(f"{filename} is not a version {VERSION} plant binary log")
+            # A torn last record would shift every record appended after it
+            partial = (size - HEADER.size) % RECORD.size
+            if partial:
+                printlog(f"Repairing {filename}: dropping a torn last record of {partial} bytes")
+                file.truncate(size - partial)
+        self.files[filename] = file
+        self.buffers[filename] = []
+        self.plant_ids[filename] = load_plant_ids(filename)
+        return file
+
+
+    def intern(self, filename, plant_id):
+        plant_ids = self.plant_ids[filename]
+        if plant_id not in plant_ids:
+            plant_ids.append(plant_id)
+            # New ids are rare, rewrite the sidecar atomically
+            temp_filename = filename + ".ids.tmp"
+            with open(temp_filename, 'w') as ids_file:
+                json.dump(plant_ids, ids_file)
+            os.replace(temp_filename, filename + ".ids")
+        return plant_ids.index(plant_id)
+
+
+    def pack(self, filename, data):
+        flags = 0
+        values = []
+        for field, flag in zip(FLOAT_FIELDS, MISSING_FLAGS):
+            value = data.get(field)
+            if value is None:
+                flags |= flag
+                value = math.nan
+            values.append(value)
+        if data.get("was_watered") is None:
+            flags |= MISSING_WATERING
+        return RECORD.pack(row_timestamp(data), *values, data.get("ml") or 0, data.get("was_watered") or 0,
+                           flags, self.intern(filename, data["plant_id"]))
+
+
+    def write(self, filename, data, headers=None):
+        if filename not in self.files:
+            self.open_file(filename)
+        self.buffers[filename].append(self.pack(filename, data))
+        self.pending_rows += 1
+
+
+    def flush_due(self):
+        if self.pending_rows == 0:
+            return False
+        return (self.pending_rows >= self.flush_rows
+                or time.monotonic() - self.last_flush >= self.flush_seconds)
+
+
+    def flush_if_due(self):
+        if self.flush_due():
+            return self.flush()
+        return False
+
+
+    def flush(self):
+        flushed = True
+        for filename, records in self.buffers.items():
+            if not records:
+                continue
+            file = self.files[filename]
+            try:
+                file.write(b"".join(records))
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+                self.pending_rows -= len(records)
+                records.clear()
+            except (OSError, ValueError) as e:
+                # Keep the records buffered and try again on the next flush
+                printlog(f"Error flushing {filename}: {e}")
+                flushed = False
+        self.last_flush = time.monotonic()
+        return flushed
+
+
+    def close_file(self, filename):
+        # Write out the buffered rows and release the handle of a file that is done, e.g. a closed partition
+        if not self.flush():
+            return False
+        file = self.files.pop(filename, None)
+        if file is not None:
+            file.close()
+        self.buffers.pop(filename, None)
+        self.plant_ids.pop(filename, None)
+        return True
+
+
+    def close(self):
+        # False when rows could not be written out, they are lost with the buffer
+        flushed = self.flush()
+        for file in self.files.values():
+            file.close()
+        self.files.clear()
+        self.buffers.clear()
+        self.pending_rows = 0
+        return flushed
+
+
+class BinaryLogReader:
+
+
+    def __init__(self, filename):
+        import numpy as np
+
+        from partitions import COMPRESSORS, open_partition
+
+        self.filename = filename
+        # Compressed partitions are read into memory, the others are mapped
+        uncompressed_filename = filename
+        for _, extension in COMPRESSORS.values():
+            if filename.endswith(extension):
+                uncompressed_filename = filename[:-len(extension)]
+        with open_partition(filename) as file:
+            magic, version, record_size = HEADER.unpack(file.read(HEADER.size))
+            data = file.read() if uncompressed_filename != filename else None
+        if magic != MAGIC or version != VERSION or record_size != RECORD.size:
+            raise ValueError(f"{filename} is not a version {VERSION} plant binary log")
+        # A torn record at the end from a power cut is left out
+        if data is not None:
+            self.records = np.frombuffer(data, dtype=record_dtype(), count=len(data) // RECORD.size)
+        else:
+            count = (os.path.getsize(filename) - HEADER.size) // RECORD.size
+            if count:
+                self.records = np.memmap(filename, dtype=record_dtype(), mode='r', offset=HEADER.size,
+                                         shape=(count,))
+            else:
+                self.records = np.empty(0, dtype=record_dtype())
+        self.plant_ids = load_plant_ids(uncompressed_filename)
+
+
+    def __len__(self):
+        return len(self.records)
+
+
+    def __getitem__(self, column):
+        # Zero-copy view of one column
+        return self.records[column]
+
+
+    def columns(self):
+        return [name for name in self.records.dtype.names if name != "reserved"]
+
+
+    def plant_id(self, code):
+        return self.plant_ids[code]
+
+
+    def missing(self, flag):
+        # Boolean mask of the records missing a reading, e.g. MISSING_SOIL
+        return (self.records["flags"] & flag) != 0
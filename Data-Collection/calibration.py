@@ -9,22 +9,21 @@ Author: Tommaso Bacci
 
 import time
 import json
-import busio
-import board
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
+from hardware import get_backend
+from plant_registry import PlantRegistry
 
 
-def calibrate_soil_moisture(filename, channel):
+def calibrate_soil_moisture(filename, channel, backend=None, bus=1, address=0x48):
     max_value = None
     min_value = None
+    backend = backend or get_backend()
 
     # Create the ADS object
-    i2c = busio.I2C(board.SCL, board.SDA)
-    ads = ADS.ADS1115(i2c)
+    i2c = backend.make_i2c(bus)
+    ads = backend.make_ads(i2c, address)
 
-    # Create single-ended input on the specified channel
-    chan = AnalogIn(ads, channel)
+    # Create single-ended input on the specified channel ("P0" to "P3")
+    chan = backend.make_analog_in(ads, channel)
 
     baseline_check = input("Is Soil Moisture Sensor Dry? (enter 'y' to proceed): ")
 
@@ -66,10 +65,9 @@ def calibrate_soil_moisture(filename, channel):
 
 
 if __name__ == "__main__":
-    # Calibration for the first sensor
-    print("\nSENSOR #1\n")
-    calibrate_soil_moisture('calibration_data_1.json', ADS.P0)
-
-    # Calibration for the second sensor
-    print("\nSENSOR #2\n")
-    calibrate_soil_moisture('calibration_data_2.json', ADS.P1)
+    # Calibration for every sensor in bot_config.json
+    plant_registry = PlantRegistry()
+    backend = get_backend(plant_registry.config)
+    for number, plant in enumerate(plant_registry, start=1):
+        print(f"\nSENSOR #{number} ({plant.plant_id}, bus {plant.bus}, ADS {plant.ads_address:#x} {plant.channel})\n")
+        calibrate_soil_moisture(plant.calibration_file, plant.channel, backend, plant.bus, plant.ads_address)
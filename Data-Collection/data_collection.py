@@ -6,121 +6,557 @@ This script collects sensor data from various environmental sensors and logs it
 Author: Tommaso Bacci
 """
 
+import os
 import time
-import csv
 import datetime
-import sensor_manager
 import logging
+from data_writer import DataWriter
+from hardware import get_backend
+from interval_scheduler import IntervalScheduler
+from multirate import MultiRateScheduler, Stream
+from plant_registry import CONFIG_FILENAME, PlantRegistry
+from soil_state import SoilStateStore
+from tail_reader import read_tail
+from utils import printlog, row_timestamp
 
-# Global variables
-csv_filename_1 = "plant_data_1.csv"
-csv_filename_2 = "plant_data_2.csv"
+# Global variables, set up by start() so importing this module never touches the hardware
+plant_registry = None
+plant_index = None
+backend = None
+soil_state = None
+sensor_manager = None
+data_writer = None
+aggregate_writer = None
+stream_writer = None
+wal = None
+write_pipeline = None
+live_feed = None
+replayed_sequence = 0   # cycles up to this write-ahead log sequence were written by replay_wal() on start
+last_timestamps = {}    # plant_id -> time of the last reading written, restored from the data files on start
 headers = ["plant_order", "plant_family", "plant_subfamily", "plant_genus", "day", "time",
            "soil_moisture_percent", "lux", "temperature", "humidity", "was_watered", "ml", "environment", "plant_id"] 
-sensor_manager = sensor_manager.SensorManager()
+# Lean readings row of the normalized layout, taxonomy is kept once in the plant metadata table
+reading_headers = ["day", "time", "soil_moisture_percent", "lux", "temperature", "humidity", "was_watered", "ml",
+                   "plant_id"]
+sampled_fields = ["soil_moisture_percent", "lux", "temperature", "humidity"]
+light_headers = ["day", "time", "lux"]
+air_headers = ["day", "time", "temperature", "humidity"]
+soil_headers = ["day", "time", "soil_moisture_percent", "was_watered", "ml", "plant_id"]
+environment_headers = ["day", "time", "lux", "temperature", "humidity"]
+# Layout of the rows each kind of stream_writer entry writes
+stream_headers = {"environment": environment_headers, "light": light_headers, "air": air_headers,
+                  "soil": soil_headers}
 
 # Constants
 MAX_RETRY = 3
 RETRY_WAIT = 3
+INTERVAL_SECONDS = 30 * 60  # log on xx:00 and xx:30, can be under a second for high-rate sampling
+FLUSH_ROWS = 20         # flush buffered rows after this many readings...
+FLUSH_SECONDS = 600     # ...or after this many seconds since the last flush
+FSYNC = True            # force flushed rows onto the SD card
+CONCURRENT_READS = True # read all sensors at the same time instead of one after another
+OVERSAMPLE = False      # sample during the interval and log aggregates instead of one reading
+SAMPLE_PERIOD = 2       # seconds between samples, the DHT11 can't be read faster than ~1 Hz
+SAMPLE_CAPACITY = 1024  # samples kept per field for the median, memory doesn't grow past this
+CHECKPOINT_EVERY = 96   # soil state journal entries between checkpoints
+METRICS_FILE = "plant_sensors.prom"  # Prometheus metrics rewritten every cycle, next to the config
+METRICS_PORT = None     # serve the metrics on http://127.0.0.1:<port>/ too, None to disable
+METRICS_PERIOD = 60     # seconds between metrics file rewrites in multi-rate mode
+MULTIRATE = False       # read every sensor stream on its own period instead of one cycle
+LIGHT_PERIOD = 1        # seconds between light readings in multi-rate mode
+AIR_PERIOD = 60         # seconds between air readings, the DHT11 needs ~1s between reads
+SOIL_PERIOD = 30 * 60   # seconds between soil readings for plants without a soil_period
+COALESCE_WINDOW = 0.05  # streams due within this many seconds share one read window
+STORAGE = "csv"         # "csv" or "binary" fixed-width records (see binary_log.py) for the readings
+NORMALIZED = False      # csv rows without the taxonomy, rebuild the full view with export.py
+SHARED_ENVIRONMENT = False  # ambient readings once per bot in environment.csv, soil and watering per plant
+PARTITION = None        # "day", "month" or "year" files under Plant-Data/<plant_id>/, None for one file per plant
+COMPRESS = "lzma"       # "lzma" or "gzip" closed partitions in the background, None to keep them as they are
+INDEX = True            # keep a sparse time index next to every csv for data_store.py queries
+INDEX_ROWS = 64         # an index entry every this many rows...
+INDEX_BYTES = 8192      # ...or this many bytes of csv, whichever comes first
+WAL = True              # commit every cycle to a write-ahead log first, so buffered rows survive a power cut
+PIPELINE = False        # write the rows on a separate thread, a slow SD card never delays the next sample
+QUEUE_SIZE = 64         # cycles the write queue holds...
+QUEUE_POLICY = "block"  # ...then "block" the loop, "drop_oldest" or "spill" to Plant-Data/write_queue.spill
+ADS_SCAN = False        # convert every soil channel continuously in the background (a thread per bus), reads take the latest value
+ADS_DATA_RATE = 860     # ADS1115 samples per second while scanning, 8 to 860
+ADS_GAIN = 1            # ADS1115 gain while scanning, 1 is +/-4.096V
+ADS_SCAN_PERIOD = 0.1   # seconds between scans of all channels
+DHT_PROCESS = False     # poll the DHT11 in its own process, air readings take its last valid value
+DHT_PERIOD = 2          # seconds between DHT11 polls in that process
+DHT_MAX_AGE = 60        # seconds a last valid air reading is still logged
+LIVE_FEED = False       # publish the latest readings in shared memory for local consumers (see live_feed.py)
+LIVE_FEED_KEY = 0x504C4E54  # System V key of the live feed segment
 
-# Plant information
-plant_order = "Alismatales"
-plant_family = "Araceae"
-plant_subfamily = "Monsteroideae"
-plant_genus = "Spathiphylleae"
-enivronment = "indoor"
-plant_1_id = "peace-lily-1"
-plant_2_id = "peace-lily-2"
 
+def start(config_filename=CONFIG_FILENAME):
+    # Load the config and bring up the sensors. numpy and the drivers are only imported here
+    global plant_registry, plant_index, backend, soil_state, sensor_manager, data_writer, aggregate_writer, stream_writer, wal, write_pipeline, live_feed
+    from oversampler import aggregate_headers
+    from sensor_manager import SensorManager
+
+    plant_registry = PlantRegistry(config_filename)
+    plant_index = {plant.plant_id: index for index, plant in enumerate(plant_registry)}
+    backend = get_backend(plant_registry.config)
+    soil_state = SoilStateStore(plant_registry.soil_state_file, CHECKPOINT_EVERY, FSYNC)
+    recover_tails()
+    sensor_manager = SensorManager(plant_registry, soil_state, backend).start(ADS_SCAN, ADS_DATA_RATE, ADS_GAIN,
+                                                                              ADS_SCAN_PERIOD, DHT_PROCESS, DHT_PERIOD,
+                                                                              DHT_MAX_AGE)
+
+    if STORAGE == "binary":
+        from binary_log import BinaryLogWriter
+        data_writer = BinaryLogWriter(FLUSH_ROWS, FLUSH_SECONDS, FSYNC)
+    else:
+        data_writer = DataWriter(row_headers(), FLUSH_ROWS, FLUSH_SECONDS, FSYNC, INDEX, INDEX_ROWS, INDEX_BYTES)
+    if PARTITION is not None:
+        from partitions import PartitionedWriter
+        data_writer = PartitionedWriter(data_writer, PARTITION, COMPRESS)
+    # Aggregates keep the ambient fields on every row, each plant's interval has its own
+    aggregate_writer = DataWriter(aggregate_headers(reading_headers if NORMALIZED or SHARED_ENVIRONMENT else headers,
+                                                    sampled_fields), FLUSH_ROWS, FLUSH_SECONDS, FSYNC)
+    if NORMALIZED or SHARED_ENVIRONMENT or STORAGE == "binary":
+        plant_registry.write_metadata()
+    # Multi-rate streams have their own layouts and stay csv
+    stream_writer = DataWriter(soil_headers, FLUSH_ROWS, FLUSH_SECONDS, FSYNC)
+
+    if WAL:
+        from wal import WriteAheadLog
+        wal = WriteAheadLog(plant_registry.wal_file, FSYNC)
+        replay_wal()
+
+    if PIPELINE:
+        from pipeline import WritePipeline
+        write_pipeline = WritePipeline(apply_entries, QUEUE_SIZE, QUEUE_POLICY,
+                                       plant_registry.path("Plant-Data/write_queue.spill"), sensor_manager.metrics)
+
+    if LIVE_FEED:
+        from live_feed import LiveFeedWriter
+        live_feed = LiveFeedWriter([plant.plant_id for plant in plant_registry], LIVE_FEED_KEY)
+
+
+def stop():
+    # Never lose the buffered tail on shutdown
+    printlog("\nFlushing buffered data...")
+    if write_pipeline is not None:
+        # Writes everything still queued
+        write_pipeline.close()
+    flushed = all([data_writer.close(), aggregate_writer.close(), stream_writer.close()])
+    if wal is not None:
+        if flushed:
+            # Everything is flushed, nothing left to replay
+            wal.checkpoint()
+        else:
+            printlog("Buffered rows could not be written, they are replayed from the write-ahead log on the next start")
+        wal.close()
+    soil_state.close()
+    sensor_manager.stop()
+    if live_feed is not None:
+        live_feed.close()
+
+
+def tail_filename(plant):
+    # The file the last reading of the plant went to
+    filename = data_filename(plant)
+    if PARTITION is not None:
+        from partitions import find_partitions
+        partitions = find_partitions(os.path.join(os.path.dirname(filename), plant.plant_id))
+        return partitions[-1] if partitions else None
+    return filename
+
+
+def recover_tails():
+    # Pick up from the last reading written: repair a torn last row, restore the last level and report the gap
+    now = time.time()
+    for plant in plant_registry:
+        filename = tail_filename(plant)
+        tail = read_tail(filename) if filename else None
+        if tail is None or tail.row is None:
+            continue
+        last_timestamps[plant.plant_id] = tail.timestamp
+        level = tail.row.get("soil_moisture_percent")
+        if soil_state.get(plant.plant_id, None) is None and level not in (None, ""):
+            soil_state.update(plant.plant_id, round(float(level), 2))
+        gap = now - tail.timestamp
+        printlog(f"Last reading of {plant.plant_id} at {datetime.datetime.fromtimestamp(tail.timestamp)}, "
+                 f"collection gap of {gap / 3600:.1f}h (~{max(0, int(gap // INTERVAL_SECONDS) - 1)} intervals missed)")
+
+
+def write_metrics():
+    sensor_manager.metrics.write(plant_registry.path(METRICS_FILE))
+
+
+
+def row_headers():
+    if SHARED_ENVIRONMENT:
+        return soil_headers
+    return reading_headers if NORMALIZED else headers
+
+
+def data_filename(plant):
+    # Where the readings of a plant go for the chosen STORAGE
+    if STORAGE == "binary":
+        return plant.binary_filename
+    if SHARED_ENVIRONMENT:
+        return plant.soil_filename
+    return plant.readings_filename if NORMALIZED else plant.csv_filename
+
+
+def plant_row(plant, reading_day, reading_time):
+    # Plant information, readings are filled in by the caller
+    if NORMALIZED or SHARED_ENVIRONMENT:
+        return {"day": reading_day, "time": reading_time, "plant_id": plant.plant_id}
+    return {"plant_order": plant.plant_order, "plant_family": plant.plant_family,
+            "plant_subfamily": plant.plant_subfamily, "plant_genus": plant.plant_genus,
+            "day": reading_day, "time": reading_time, "environment": plant.environment,
+            "plant_id": plant.plant_id}
 
 
 def package_data():
     try:
-        global headers, enivronment, plant_1_id, plant_2_id
+        global headers
 
         # Date and time
         now = datetime.datetime.now()
         reading_day = now.strftime("%Y-%m-%d")
         reading_time = now.strftime("%H:%M:%S")
 
-        # Common Sensor Readings
-        lux = sensor_manager.get_light_reading()
-        humidity, temperature = sensor_manager.get_air_reading()
-        
-        # Individual Soil Moisture Readings + watering
-        sensors = sensor_manager.get_soil_readings()
-        soil_moisture_percent_1, was_watered_1, ml_1 = sensors[0]
-        soil_moisture_percent_2, was_watered_2, ml_2 = sensors[1]
+        if CONCURRENT_READS:
+            # All sensors at once, sharing the timestamp above
+            lux, air, sensors = sensor_manager.get_all_readings()
+            humidity, temperature = air
+        else:
+            # Common Sensor Readings
+            lux = sensor_manager.get_light_reading()
+            humidity, temperature = sensor_manager.get_air_reading()
+            
+            # Individual Soil Moisture Readings + watering
+            sensors = sensor_manager.get_soil_readings()
 
         printlog("\nPackaging Data...")
         
-        # Set Data
-        values_1 = [plant_order, plant_family, plant_subfamily, plant_genus, reading_day, reading_time, 
-                soil_moisture_percent_1, lux, temperature, humidity, was_watered_1, ml_1, enivronment, plant_1_id]
-        values_2 = [plant_order, plant_family, plant_subfamily, plant_genus, reading_day, reading_time, 
-                soil_moisture_percent_2, lux, temperature, humidity, was_watered_2, ml_2, enivronment, plant_2_id]
+        # Set Data, one row per registered plant
+        rows = {}
+        for plant, (soil_moisture_percent, was_watered, ml) in zip(plant_registry, sensors):
+            row = plant_row(plant, reading_day, reading_time)
+            row.update(soil_moisture_percent=soil_moisture_percent, lux=lux, temperature=temperature,
+                       humidity=humidity, was_watered=was_watered, ml=ml)
+            rows[plant.plant_id] = row
         # Return Data
         printlog("Packing OK!")
-        return dict(zip(headers, values_1)), dict(zip(headers, values_2))
+        return rows
 
     except Exception as e:
         printlog(f"Error reading sensors: {e}")
-        return None, None
+        return None
 
 
 def log_data(data, filename):
     printlog(f"\nLogging Data...")
     try:
-        global headers
-        # Open csv
-        with open(filename, 'a', newline='') as file:
-            writer = csv.DictWriter(file, fieldnames=headers)
-            # If file empty add headers
-            if file.tell() == 0:
-                writer.writeheader()
-            # Write file
-            writer.writerow(data)
+        # Buffer row, the writer flushes it to the csv (or binary log) in groups
+        data_writer.write(filename, data)
+        if "plant_id" in data:
+            last_timestamps[data["plant_id"]] = row_timestamp(data)
         printlog(f"Logging {filename} OK!")
     except Exception as e:
         printlog(f"Error logging data: {e}")
 
 
-def sleep_until_next_interval(interval_minutes):
-    current_time = datetime.datetime.now()
-    # calculate second to next interval xx:00 or xx:30
-    minutes_to_next_interval = interval_minutes - (current_time.minute % interval_minutes)
-    seconds_to_next_interval = (60 - current_time.second) + (minutes_to_next_interval - 1) * 60
-    # Sleep until
-    print(f"\nNext interval in {seconds_to_next_interval} seconds")
-    time.sleep(seconds_to_next_interval)
+def cycle_entries(rows):
+    # [writer, filename, row] of every row a cycle writes
+    entries = []
+    if SHARED_ENVIRONMENT:
+        # Ambient readings are the same for every plant, written once for the bot
+        row = next(iter(rows.values()))
+        entries.append(["environment", plant_registry.environment_file,
+                        {field: row[field] for field in environment_headers}])
+        rows = {plant_id: {field: row.get(field) for field in soil_headers} for plant_id, row in rows.items()}
+    for plant in plant_registry:
+        entries.append(["data", data_filename(plant), rows[plant.plant_id]])
+    return entries
+
+
+def write_entry(writer, filename, row):
+    if writer == "aggregate":
+        aggregate_writer.write(filename, row)
+    elif writer in stream_headers:
+        stream_writer.write(filename, row, stream_headers[writer])
+    else:
+        log_data(row, filename)
+
+
+def flush_writers(sequence=None, force=False):
+    # The writers flush together once one of them is due, so every buffered row up to sequence is on disk
+    # after a flush that succeeded and the log has nothing before it left to replay
+    writers = [data_writer, stream_writer, aggregate_writer]
+    if not force and not any(writer.flush_due() for writer in writers):
+        return
+    if all([writer.flush() for writer in writers]) and wal is not None and sequence is not None:
+        wal.checkpoint(sequence)
+
+
+def append_wal(entries):
+    # Sequence number of the cycle in the log, on the collection loop so a queued cycle is durable too
+    if wal is None:
+        return None
+    try:
+        return wal.append(entries)
+    except OSError as e:
+        # The cycle is only queued, it moves no checkpoint
+        printlog(f"Error writing the write-ahead log: {e}")
+        return None
+
+
+def apply_entries(cycle):
+    # cycle: [sequence, entries] as queued, written to the data files
+    sequence, entries = cycle
+    if sequence is not None and sequence <= replayed_sequence:
+        # Spilled before a power cut and already written again from the write-ahead log
+        return
+    for writer, filename, row in entries:
+        write_entry(writer, filename, row)
+    # Flush policy checked once the whole cycle is buffered
+    flush_writers(sequence)
+
+
+def log_rows(rows):
+    entries = cycle_entries(rows)
+    apply_entries([append_wal(entries), entries])
+
+
+def commit_entries(entries):
+    # Logged first, then written here or on the pipeline thread
+    cycle = [append_wal(entries), entries]
+    if write_pipeline is not None:
+        write_pipeline.put(cycle)
+    else:
+        apply_entries(cycle)
+
+
+def publish_rows(rows):
+    # Latest readings to the live feed as soon as they are read, before they are written
+    if live_feed is None:
+        return
+    row = next(iter(rows.values()))
+    live_feed.publish({field: row.get(field) for field in ["lux", "temperature", "humidity"]},
+                      {plant_id: {field: row.get(field) for field in ["soil_moisture_percent", "was_watered", "ml"]}
+                       for plant_id, row in rows.items()}, row_timestamp(row))
+
+
+def replay_wal():
+    # Rows of the cycles the log holds that never made it to the data files, after their repaired tails
+    global replayed_sequence
+    tails = {}
+    replayed = 0
+    for sequence, entries in wal.recover():
+        for writer, filename, row in entries:
+            written_filename = filename
+            if writer == "data" and PARTITION is not None:
+                written_filename = data_writer.partition_filename(filename, row)
+            if written_filename not in tails:
+                tails[written_filename] = read_tail(written_filename).timestamp
+            if tails[written_filename] is not None and row_timestamp(row) <= tails[written_filename]:
+                continue
+            write_entry(writer, filename, row)
+            replayed += 1
+    if replayed:
+        printlog(f"Replayed {replayed} rows from the write-ahead log")
+    # Every cycle logged so far, including the ones also left in the spill file
+    replayed_sequence = wal.sequence
+    flush_writers(replayed_sequence, force=True)
+
+
+def oversample_interval(scheduler):
+    # Sample every SAMPLE_PERIOD seconds until the next interval, then package the aggregates
+    import numpy as np
+    from oversampler import IntervalAggregator
+
+    aggregators = [IntervalAggregator(sampled_fields, SAMPLE_CAPACITY) for _ in plant_registry]
+
+    end = scheduler.peek()
+    printlog(f"\nOversampling every {SAMPLE_PERIOD}s until next interval...")
+    while time.monotonic() < end:
+        started = time.monotonic()
+        sample = sensor_manager.sample_once()
+        air = sample["air"] or (None, None)
+        percents = sensor_manager.soil_percents([sample[plant.plant_id] for plant in plant_registry])
+        for aggregator, soil_moisture_percent in zip(aggregators, percents.tolist()):
+            aggregator.add("soil_moisture_percent", soil_moisture_percent)
+            aggregator.add("lux", sample["light"])
+            aggregator.add("humidity", air[0])
+            aggregator.add("temperature", air[1])
+        if live_feed is not None:
+            live_feed.publish({"lux": sample["light"], "humidity": air[0], "temperature": air[1]},
+                              {plant.plant_id: {"soil_moisture_percent": soil_moisture_percent}
+                               for plant, soil_moisture_percent in zip(plant_registry, percents.tolist())})
+        time.sleep(max(0, min(SAMPLE_PERIOD - (time.monotonic() - started), end - time.monotonic())))
+
+    # Date and time of the interval boundary
+    now = datetime.datetime.now()
+    rows = {}
+    for plant, aggregator in zip(plant_registry, aggregators):
+        row = plant_row(plant, now.strftime("%Y-%m-%d"), now.strftime("%H:%M:%S"))
+        for field in sampled_fields:
+            row.update(aggregator.aggregate(field))
+        rows[plant.plant_id] = row
+    # Watering is judged on the interval mean
+    means = [rows[plant.plant_id]["soil_moisture_percent_mean"] for plant in plant_registry]
+    soil_data = sensor_manager.soil_readings(np.array(means, dtype=float))
+    for plant, (_, was_watered, ml) in zip(plant_registry, soil_data):
+        rows[plant.plant_id].update(was_watered=was_watered, ml=ml)
+    return rows
+
+
+def make_streams():
+    # Light, air and one soil stream per plant, each with its own output
+    streams = [
+        Stream("light", LIGHT_PERIOD, {"light": sensor_manager.read_light}, light_headers,
+               os.path.join(plant_registry.stream_dir, "light.csv")),
+        Stream("air", AIR_PERIOD, {"air": sensor_manager.read_air}, air_headers,
+               os.path.join(plant_registry.stream_dir, "air.csv"), group="dht"),
+    ]
+    for plant in plant_registry:
+        streams.append(Stream(plant.plant_id, plant.soil_period or SOIL_PERIOD,
+                              {plant.plant_id: sensor_manager.soil_reads[plant.plant_id]},
+                              soil_headers, os.path.join(plant_registry.stream_dir, f"soil_{plant.plant_id}.csv")))
+    return streams
+
+
+def tick_row(stream):
+    # Date and time of the tick the stream was due for, however late the read ran
+    tick = datetime.datetime.fromtimestamp(stream.tick)
+    return {"day": tick.strftime("%Y-%m-%d"), "time": tick.strftime("%H:%M:%S")}
+
+
+def log_streams(batch, results):
+    entries = []
+    soil_streams = []
+    for stream in batch:
+        row = tick_row(stream)
+        if stream.name == "light":
+            row["lux"] = results["light"].value
+        elif stream.name == "air":
+            row["humidity"], row["temperature"] = results["air"].value or (None, None)
+        else:
+            soil_streams.append(stream)
+            continue
+        entries.append([stream.name, stream.filename, row])
+        if live_feed is not None:
+            live_feed.publish({field: row[field] for field in row if field not in ("day", "time")},
+                              timestamp=stream.tick)
+
+    if soil_streams:
+        # Every soil channel of the batch converted in one pass
+        plant_indices = [plant_index[stream.name] for stream in soil_streams]
+        voltages = [results[stream.name].value for stream in soil_streams]
+        soil_data = sensor_manager.soil_results(voltages, plant_indices)
+        for stream, (soil_moisture_percent, was_watered, ml) in zip(soil_streams, soil_data):
+            row = tick_row(stream)
+            row.update(soil_moisture_percent=soil_moisture_percent, was_watered=was_watered, ml=ml,
+                       plant_id=stream.name)
+            entries.append(["soil", stream.filename, row])
+        if live_feed is not None:
+            live_feed.publish(plants={stream.name: {"soil_moisture_percent": soil_moisture_percent,
+                                                    "was_watered": was_watered, "ml": ml}
+                                      for stream, (soil_moisture_percent, was_watered, ml)
+                                      in zip(soil_streams, soil_data)}, timestamp=soil_streams[0].tick)
+    commit_entries(entries)
+
+
+def run_multirate():
+    from concurrent.futures import ThreadPoolExecutor
+
+    scheduler = MultiRateScheduler(make_streams(), COALESCE_WINDOW)
+    printlog(f"\nMulti-rate sampling: " + ", ".join(f"{stream.name} every {stream.period}s" for stream in scheduler.streams))
+    # The DHT11 is read on its own thread, its retries never hold back a light tick
+    background = ThreadPoolExecutor(max_workers=1)
+    pending = []
+    last_metrics = time.monotonic()
+    try:
+        while True:
+            for batch in scheduler.wait():
+                reads = scheduler.reads(batch)
+                deadlines = scheduler.deadlines(batch, sensor_manager.CYCLE_DEADLINE)
+                if batch[0].group == "i2c":
+                    log_streams(batch, sensor_manager.read_batch(reads, deadlines))
+                else:
+                    pending.append((batch, background.submit(sensor_manager.read_batch, reads, deadlines)))
+            # Background reads are logged on the loop, every write stays on this thread
+            for batch, future in [(batch, future) for batch, future in pending if future.done()]:
+                pending.remove((batch, future))
+                log_streams(batch, future.result())
+            if time.monotonic() - last_metrics >= METRICS_PERIOD:
+                write_metrics()
+                last_metrics = time.monotonic()
+    finally:
+        background.shutdown()
+        for batch, future in pending:
+            log_streams(batch, future.result())
 
 
 def testHardware():
     sensor_manager.test()
 
 if __name__ == "__main__":
-    # Get last water levels
-    # for x in range(2):
-    #     last_level = float(input(f"Last water moisture level (plant {x+1}) ? "))
-    #     sensor_manager.soil_sensors[x] = last_level
+    # Last water levels and the collection gap are recovered from the data files by start()
+
+    logging.basicConfig(filename="data_collection.log", level=logging.INFO,
+                        format="%(asctime)s %(message)s")
+    start()
+
+    if METRICS_PORT is not None:
+        sensor_manager.metrics.serve(METRICS_PORT)
 
     # Start program
-    while True:
-        #Get time and date
-        now = datetime.datetime.now()
-        day_now = now.strftime("%d/%m/%Y")
-        time_now = now.strftime("%H:%M:%S")
-        printlog(f"\n########## Date: {day_now} Time: {time_now}")
-        try:
-            # Pack and log data to csv
-            data_1, data_2 = package_data()
-            if data_1 and data_2 is not None:
-                log_data(data_1, csv_filename_1)
-                log_data(data_2, csv_filename_2)
-            # Set and sleep to next interval
-            sleep_until_next_interval(30)
-        except KeyboardInterrupt:
-            break
+    scheduler = IntervalScheduler(INTERVAL_SECONDS)
+    try:
+        if MULTIRATE:
+            # Every stream on its own period until Ctrl+C
+            try:
+                run_multirate()
+            except KeyboardInterrupt:
+                pass
+        else:
+            while True:
+                #Get time and date
+                now = datetime.datetime.now()
+                day_now = now.strftime("%d/%m/%Y")
+                time_now = now.strftime("%H:%M:%S")
+                printlog(f"\n########## Date: {day_now} Time: {time_now}")
+                try:
+                    if OVERSAMPLE:
+                        # Sample through the interval and log the aggregates at its end
+                        aggregates = oversample_interval(scheduler)
+                        commit_entries([["aggregate", plant.aggregate_filename, aggregates[plant.plant_id]]
+                                        for plant in plant_registry])
+                        write_metrics()
+                        # The interval was sampled up to its tick, consume it instead of waiting a whole one
+                        scheduler.due()
+                        scheduler.advance()
+                        continue
+                    # Pack and log data to csv
+                    rows = package_data()
+                    if rows is None:
+                        pass
+                    elif write_pipeline is not None:
+                        publish_rows(rows)
+                        # Logged here, written on the pipeline thread while the loop waits for the next interval
+                        entries = cycle_entries(rows)
+                        write_pipeline.put([append_wal(entries), entries])
+                        printlog("Write queue: depth {depth}, lag {lag:.3f}s, dropped {dropped}, spilled {spilled}"
+                                 .format(**write_pipeline.stats()))
+                    else:
+                        publish_rows(rows)
+                        log_rows(rows)
+                    write_metrics()
+                    # Sleep to next interval, accounting for the time the cycle took
+                    scheduler.wait()
+                except KeyboardInterrupt:
+                    break
+    finally:
+        stop()
 
         # try:
         #     testHardware()
@@ -0,0 +1,153 @@
+"""
+Data Store
+
+Query API over the collected readings: the rows of one plant between two times, projected to the
+columns asked for. Csv files are searched through the sparse `<file>.idx` DataWriter keeps (a
+timestamp -> byte offset entry every few dozen rows), so a query seeks to the block holding its start
+and reads forward only until its end. Binary logs are fixed width and searched directly on the
+memory-mapped timestamp column. Day partitions are picked from their manifest first.
+
+Usage: python data_store.py <plant_id> --start 2024-03-01 --end "2024-03-02 12:00:00" --columns lux
+"""
+
+import argparse
+import csv
+import datetime
+import io
+import os
+import sys
+import numpy as np
+from data_writer import INDEX_ENTRY
+from partitions import COMPRESSORS, find_partitions, open_partition
+from plant_registry import CONFIG_FILENAME, PlantRegistry
+
+
+# Partial start and end times are completed to the earliest and latest moment they cover
+EARLIEST = "0000-01-01 00:00:00"
+LATEST = "9999-12-31 23:59:59"
+
+
+def moment_string(moment, bounds):
+    if moment is None:
+        return bounds
+    if isinstance(moment, datetime.datetime):
+        moment = moment.strftime("%Y-%m-%d %H:%M:%S")
+    elif isinstance(moment, datetime.date):
+        moment = moment.strftime("%Y-%m-%d")
+    return moment + bounds[len(moment):]
+
+
+def moment_timestamp(moment):
+    try:
+        return datetime.datetime.strptime(moment, "%Y-%m-%d %H:%M:%S").timestamp()
+    except (ValueError, OverflowError):
+        # Bounds outside what the platform clock can represent
+        return -np.inf if moment < "1970" else np.inf
+
+
+def load_index(filename):
+    # (timestamp, offset) of every indexed block, an index torn by a power cut loses its last entry
+    try:
+        with open(filename + ".idx", 'rb') as index_file:
+            data = index_file.read()
+    except FileNotFoundError:
+        data = b""
+    data = data[:len(data) - len(data) % INDEX_ENTRY.size]
+    return np.frombuffer(data, dtype=[("timestamp", "<f8"), ("offset", "<u8")])
+
+
+class PlantDataStore:
+
+
+    def __init__(self, plant_registry=None):
+        self.plant_registry = plant_registry or PlantRegistry(CONFIG_FILENAME)
+
+
+    def files(self, plant, start, end):
+        # Partitions of the time range when the plant is partitioned, the plant's readings files otherwise
+        directory = os.path.join(os.path.dirname(plant.csv_filename), plant.plant_id)
+        if os.path.isdir(directory):
+            return find_partitions(directory, start, end)
+        return [filename for filename in [plant.csv_filename, plant.readings_filename, plant.soil_filename,
+                                          plant.binary_filename] if os.path.exists(filename)]
+
+
+    def query(self, plant_id, start=None, end=None, columns=None):
+        # Columns (as numpy arrays) of the plant's rows with start <= day time <= end
+        plant = self.plant_registry.get(plant_id)
+        start = moment_string(start, EARLIEST)
+        end = moment_string(end, LATEST)
+        parts = []
+        for filename in self.files(plant, start, end):
+            if filename.endswith((".bin", ".bin.xz", ".bin.gz")):
+                parts.append(self.query_binary(filename, start, end, columns))
+            else:
+                parts.append(self.query_csv(filename, start, end, columns))
+        parts = [part for part in parts if part]
+        if not parts:
+            return {column: np.array([], dtype=object) for column in columns or []}
+        fields = [field for field in parts[0] if all(field in part for part in parts)]
+        return {field: np.concatenate([part[field] for part in parts]) for field in fields}
+
+
+    def query_csv(self, filename, start, end, columns=None):
+        # Index entries are per block, start from the last block beginning at or before start
+        index = load_index(self.index_filename(filename))
+        block = np.searchsorted(index["timestamp"], moment_timestamp(start), side="right") - 1
+        with open_partition(filename) as file:
+            fields = next(csv.reader([file.readline().decode()]))
+            if block >= 0:
+                file.seek(int(index["offset"][block]))
+            day, time = fields.index("day"), fields.index("time")
+            rows = []
+            for row in csv.reader(io.TextIOWrapper(file, newline='')):
+                if len(row) != len(fields):
+                    # Blank or torn line
+                    continue
+                moment = f"{row[day]} {row[time]}"
+                if moment > end:
+                    break
+                if moment >= start:
+                    rows.append(row)
+        selected = [fields.index(column) for column in columns or fields if column in fields]
+        if not rows:
+            return {}
+        values = list(zip(*rows))
+        return {fields[position]: np.array(values[position], dtype=object) for position in selected}
+
+
+    def index_filename(self, filename):
+        # Compressed partitions keep the index of the csv they came from
+        for _, extension in COMPRESSORS.values():
+            if filename.endswith(extension):
+                return filename[:-len(extension)]
+        return filename
+
+
+    def query_binary(self, filename, start, end, columns=None):
+        from binary_log import BinaryLogReader
+
+        reader = BinaryLogReader(filename)
+        timestamps = reader["timestamp"]
+        first = np.searchsorted(timestamps, moment_timestamp(start), side="left")
+        last = np.searchsorted(timestamps, moment_timestamp(end), side="right")
+        if first == last:
+            return {}
+        # Slices of the memory map, nothing is copied
+        records = reader.records[first:last]
+        return {column: records[column] for column in columns or reader.columns() if column in reader.columns()}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Readings of one plant over a time range")
+    parser.add_argument("plant_id")
+    parser.add_argument("--config", default=CONFIG_FILENAME)
+    parser.add_argument("--start", help="YYYY-MM-DD[ HH:MM:SS]")
+    parser.add_argument("--end", help="YYYY-MM-DD[ HH:MM:SS], inclusive")
+    parser.add_argument("--columns", nargs="*")
+    args = parser.parse_args()
+
+    result = PlantDataStore(PlantRegistry(args.config)).query(args.plant_id, args.start, args.end, args.columns)
+    writer = csv.writer(sys.stdout)
+    writer.writerow(list(result))
+    writer.writerows(zip(*result.values()))
@@ -0,0 +1,192 @@
+"""
+Data Writer
+
+Keeps a single open handle per CSV file and buffers rows in memory, writing them out in groups
+instead of opening, seeking and closing the file for every reading.
+
+Rows are flushed when the buffer reaches `flush_rows` rows or when `flush_seconds` have passed
+since the last flush, optionally followed by an fsync. The caller checks this with `flush_if_due()`
+(or `flush_due()` then `flush()`) once all rows of a cycle are buffered, so a cycle is never split
+with its last rows left behind. `close()` always writes the buffered tail.
+
+With `index` the first row of a file, then a row every `index_rows` rows or `index_bytes` bytes,
+whatever the flush size, gets a (timestamp, byte offset) entry in a sparse `<file>.idx`, which lets
+data_store.py seek straight to a time range.
+"""
+
+import csv
+import io
+import os
+import struct
+import time
+from utils import printlog, row_timestamp
+
+
+# Sparse index entry: timestamp of the first row of an indexed block and its byte offset in the csv
+INDEX_ENTRY = struct.Struct("<dQ")
+
+
+class DataWriter:
+
+
+    def __init__(self, headers, flush_rows=20, flush_seconds=600, fsync=False, index=False, index_rows=64,
+                 index_bytes=8192):
+        self.headers = headers
+        self.flush_rows = flush_rows
+        self.flush_seconds = flush_seconds
+        self.fsync = fsync
+        self.index = index
+        self.index_rows = index_rows
+        self.index_bytes = index_bytes
+        self.files = {}
+        self.index_files = {}
+        # filename -> (rows, bytes) written since its last index entry, None until the first one
+        self.index_marks = {}
+        self.buffers = {}
+        self.file_headers = {}
+        self.pending_rows = 0
+        self.last_flush = time.monotonic()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def open_file(self, filename, headers=None):
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        file = open(filename, 'ab')
+        self.files[filename] = file
+        self.buffers[filename] = []
+        # Files written with their own headers, e.g. per-stream outputs
+        self.file_headers[filename] = headers or self.headers
+        # If file empty add headers
+        if file.tell() == 0:
+            self.buffers[filename].append(None)
+        return file
+
+
+    def write(self, filename, data, headers=None):
+        if filename not in self.files:
+            self.open_file(filename, headers)
+        self.buffers[filename].append(data)
+        self.pending_rows += 1
+
+
+    def flush_due(self):
+        if self.pending_rows == 0:
+            return False
+        return (self.pending_rows >= self.flush_rows
+                or time.monotonic() - self.last_flush >= self.flush_seconds)
+
+
+    def flush_if_due(self):
+        if self.flush_due():
+            return self.flush()
+        return False
+
+
+    def format_lines(self, rows, headers=None):
+        # Encoded csv line of every row, None is the header
+        text = io.StringIO()
+        writer = csv.DictWriter(text, fieldnames=headers or self.headers)
+        lines = []
+        for row in rows:
+            if row is None:
+                writer.writeheader()
+            else:
+                writer.writerow(row)
+            lines.append(text.getvalue().encode())
+            text.seek(0)
+            text.truncate()
+        return lines
+
+
+    def format_rows(self, rows, headers=None):
+        return b"".join(self.format_lines(rows, headers))
+
+
+    def write_index(self, filename, rows, lines, offset):
+        # After the rows are on disk, so the index never points past the data
+        try:
+            entries = []
+            rows_since, bytes_since = self.index_marks.get(filename) or (None, 0)
+            for row, line in zip(rows, lines):
+                if row is not None:
+                    if rows_since is None or rows_since >= self.index_rows or bytes_since >= self.index_bytes:
+                        entries.append(INDEX_ENTRY.pack(row_timestamp(row), offset))
+                        rows_since, bytes_since = 0, 0
+                    rows_since += 1
+                    bytes_since += len(line)
+                offset += len(line)
+            self.index_marks[filename] = (rows_since, bytes_since)
+            if not entries:
+                return
+            if filename not in self.index_files:
+                self.index_files[filename] = open(filename + ".idx", 'ab')
+            index_file = self.index_files[filename]
+            index_file.write(b"".join(entries))
+            index_file.flush()
+            if self.fsync:
+                os.fsync(index_file.fileno())
+        except (OSError, KeyError, ValueError) as e:
+            # A missing entry only makes queries read a longer block, the rows themselves are safe
+            printlog(f"Error indexing {filename}: {e}")
+
+
+    def flush(self):
+        flushed = True
+        for filename, rows in self.buffers.items():
+            if not rows:
+                continue
+            file = self.files[filename]
+            try:
+                offset = file.tell()
+                lines = self.format_lines(rows, self.file_headers[filename])
+                file.write(b"".join(lines))
+                file.flush()
+                if self.fsync:
+                    os.fsync(file.fileno())
+                if self.index:
+                    self.write_index(filename, rows, lines, offset)
+                self.pending_rows -= sum(1 for row in rows if row is not None)
+                rows.clear()
+            except (OSError, ValueError) as e:
+                # Keep the rows buffered and try again on the next flush
+                printlog(f"Error flushing {filename}: {e}")
+                flushed = False
+        self.last_flush = time.monotonic()
+        return flushed
+
+
+    def close_file(self, filename):
+        # Write out the buffered rows and release the handle of a file that is done, e.g. a closed partition
+        if not self.flush():
+            return False
+        file = self.files.pop(filename, None)
+        if file is not None:
+            file.close()
+        index_file = self.index_files.pop(filename, None)
+        if index_file is not None:
+            index_file.close()
+        self.buffers.pop(filename, None)
+        self.file_headers.pop(filename, None)
+        self.index_marks.pop(filename, None)
+        return True
+
+
+    def close(self):
+        # False when rows could not be written out, they are lost with the buffer
+        flushed = self.flush()
+        for file in list(self.files.values()) + list(self.index_files.values()):
+            file.close()
+        self.files.clear()
+        self.index_files.clear()
+        self.index_marks.clear()
+        self.buffers.clear()
+        self.file_headers.clear()
+        self.pending_rows = 0
+        return flushed
@@ -0,0 +1,122 @@
+"""
+DHT Reader
+
+Runs the DHT11 in its own process. The driver bit-bangs the GPIO, burns CPU and fails often with
+RuntimeError, so the process polls it at the sensor's safe rate and publishes the last valid
+humidity and temperature in shared memory, with when it was read and how the recent reads went.
+
+The collector only looks at the published value: a read never waits on the sensor, and failed DHT
+reads never cost the collection cycle any time.
+"""
+
+import math
+import multiprocessing
+import signal
+import time
+from collections import namedtuple
+from hardware import get_backend
+
+
+# quality: "good" when the last poll succeeded, "stale" when it failed and this is the last good value
+AirReading = namedtuple("AirReading", ["humidity", "temperature", "age", "quality"])
+
+# Layout of the shared values
+HUMIDITY, TEMPERATURE, READ_AT, POLLS, FAILURES, FAILED_IN_A_ROW = range(6)
+
+
+def poll(config, pin, period, shared, stopped):
+    # Runs in the reader process, the parent handles Ctrl+C and stops it
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    dht = get_backend(config).make_dht(pin)
+    try:
+        while not stopped.is_set():
+            started = time.monotonic()
+            try:
+                humidity = dht.humidity
+                temperature = dht.temperature
+                ok = humidity is not None and temperature is not None
+            except RuntimeError:
+                ok = False
+            with shared.get_lock():
+                shared[POLLS] += 1
+                if ok:
+                    shared[HUMIDITY] = humidity
+                    shared[TEMPERATURE] = temperature
+                    shared[READ_AT] = time.time()
+                    shared[FAILED_IN_A_ROW] = 0
+                else:
+                    shared[FAILURES] += 1
+                    shared[FAILED_IN_A_ROW] += 1
+            stopped.wait(max(0, period - (time.monotonic() - started)))
+    finally:
+        if hasattr(dht, "exit"):
+            # Release the DHT GPIO
+            dht.exit()
+
+
+class DHTReader:
+
+
+    def __init__(self, config=None, pin=12, period=2.0, max_age=60, metrics=None):
+        # period: seconds between polls, the DHT11 can't be read faster than ~1 Hz
+        self.config = config or {}
+        self.pin = pin
+        self.period = period
+        self.max_age = max_age
+        self.metrics = metrics
+        self.shared = multiprocessing.Array('d', [math.nan, math.nan, 0.0, 0.0, 0.0, 0.0])
+        self.stopped = multiprocessing.Event()
+        self.process = None
+
+
+    def start(self):
+        self.process = multiprocessing.Process(target=poll, name="dht-reader", daemon=True,
+                                               args=(self.config, self.pin, self.period, self.shared, self.stopped))
+        self.process.start()
+        return self
+
+
+    def stop(self):
+        self.stopped.set()
+        if self.process is not None:
+            self.process.join(self.period + 5)
+            if self.process.is_alive():
+                self.process.terminate()
+            self.process = None
+
+
+    def wait_ready(self, timeout):
+        # Give the first poll a chance so the first cycle after start has air readings
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            with self.shared.get_lock():
+                if self.shared[READ_AT]:
+                    return True
+            time.sleep(0.05)
+        return False
+
+
+    def latest(self):
+        # Never blocks on the sensor, only on the shared values lock
+        with self.shared.get_lock():
+            humidity, temperature, read_at, polls, failures, failed_in_a_row = self.shared[:]
+        age = time.time() - read_at if read_at else math.inf
+        quality = "good" if failed_in_a_row == 0 else "stale"
+        if self.metrics is not None:
+            self.metrics.set_gauge("plant_dht_reading_age_seconds", "Age of the last valid DHT reading.",
+                                   round(age, 2) if read_at else -1)
+            self.metrics.set_gauge("plant_dht_failed_polls_in_a_row", "DHT polls failed since the last valid one.",
+                                   int(failed_in_a_row))
+        if not read_at:
+            return AirReading(None, None, age, "none")
+        return AirReading(int(humidity), int(temperature), age, quality)
+
+
+    def read(self):
+        # (humidity, temperature) like a direct DHT read, fails at once (no retry helps) when nothing recent
+        reading = self.latest()
+        if reading.humidity is None:
+            raise TimeoutError("No valid DHT reading yet")
+        if reading.age > self.max_age:
+            raise TimeoutError(f"No valid DHT reading in the last {self.max_age}s")
+        return reading.humidity, reading.temperature
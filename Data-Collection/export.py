@@ -0,0 +1,178 @@
+"""
+Export
+
+Rebuilds the denormalized training view (the original plant_data csv layout) from the normalized
+layout: the plant metadata table plus the lean readings files, csv or binary, partitioned or not.
+Every reading gets its taxonomy through one vectorized lookup on plant_id instead of a dictionary
+per row.
+
+Soil readings logged with a shared environment stream get the nearest environment reading
+reattached with an as-of join (np.searchsorted over the sorted environment timestamps).
+
+Usage: python export.py [readings files...] --output Plant-Data/training.csv
+"""
+
+import argparse
+import csv
+import datetime
+import io
+import os
+import numpy as np
+from partitions import find_partitions, open_partition
+from plant_registry import CONFIG_FILENAME, METADATA_HEADERS, PlantRegistry
+
+
+ENVIRONMENT_FIELDS = ["lux", "temperature", "humidity"]
+# Same columns and order as data_collection.headers
+EXPORT_HEADERS = ["plant_order", "plant_family", "plant_subfamily", "plant_genus", "day", "time",
+                  "soil_moisture_percent", "lux", "temperature", "humidity", "was_watered", "ml", "environment",
+                  "plant_id"]
+
+
+def load_metadata(filename):
+    with open(filename, 'r', newline='') as metadata_file:
+        rows = list(csv.DictReader(metadata_file))
+    return {header: np.array([row[header] for row in rows], dtype=object) for header in METADATA_HEADERS}
+
+
+def load_csv_readings(filename):
+    with io.TextIOWrapper(open_partition(filename), newline='') as readings_file:
+        reader = csv.reader(readings_file)
+        fields = next(reader)
+        values = list(reader)
+    columns = zip(*values) if values else [[] for _ in fields]
+    return {field: np.array(column, dtype=object) for field, column in zip(fields, columns)}
+
+
+def load_binary_readings(filename):
+    from binary_log import BinaryLogReader, MISSING_FLAGS, MISSING_WATERING, FLOAT_FIELDS
+
+    reader = BinaryLogReader(filename)
+    times = [datetime.datetime.fromtimestamp(timestamp) for timestamp in reader["timestamp"].tolist()]
+    readings = {
+        "day": np.array([moment.strftime("%Y-%m-%d") for moment in times], dtype=object),
+        "time": np.array([moment.strftime("%H:%M:%S") for moment in times], dtype=object),
+        "plant_id": np.array(reader.plant_ids, dtype=object)[reader["plant"]],
+    }
+    # Missing readings go back to empty cells, like the csv writer leaves them
+    for field, flag in zip(FLOAT_FIELDS, MISSING_FLAGS):
+        column = reader[field].astype(float).round(2).astype(object)
+        column[reader.missing(flag)] = ""
+        readings[field] = column
+    for field in ["was_watered", "ml"]:
+        column = reader[field].astype(object)
+        column[reader.missing(MISSING_WATERING)] = ""
+        readings[field] = column
+    return readings
+
+
+def load_readings(filename):
+    if filename.endswith((".bin", ".bin.xz", ".bin.gz")):
+        return load_binary_readings(filename)
+    return load_csv_readings(filename)
+
+
+def timestamps(readings):
+    # Seconds since the epoch of every row, from the day and time columns
+    moments = np.char.add(np.char.add(readings["day"].astype(str), "T"), readings["time"].astype(str))
+    return moments.astype("datetime64[s]").astype(np.int64)
+
+
+def asof_join(readings, environment, fields=ENVIRONMENT_FIELDS, tolerance=None):
+    # Attach to every reading the fields of the nearest environment row, blank past tolerance seconds
+    reading_times = timestamps(readings)
+    order = np.argsort(timestamps(environment), kind="stable")
+    environment_times = timestamps(environment)[order]
+    length = len(reading_times)
+    if len(environment_times) == 0:
+        nearest = np.zeros(length, dtype=int)
+        gaps = np.full(length, np.inf)
+    else:
+        after = np.clip(np.searchsorted(environment_times, reading_times), 0, len(environment_times) - 1)
+        before = np.clip(after - 1, 0, len(environment_times) - 1)
+        use_before = np.abs(reading_times - environment_times[before]) <= np.abs(environment_times[after] - reading_times)
+        nearest = np.where(use_before, before, after)
+        gaps = np.abs(environment_times[nearest] - reading_times).astype(float)
+    unmatched = gaps > (np.inf if tolerance is None else tolerance)
+
+    joined = dict(readings)
+    for field in fields:
+        column = environment[field][order][nearest] if len(environment_times) else np.full(length, "", dtype=object)
+        column = column.astype(object)
+        column[unmatched] = ""
+        joined[field] = column
+    return joined
+
+
+def denormalize(readings, metadata):
+    # Map every distinct plant_id to its metadata row once, then gather the columns by index
+    plant_ids, inverse = np.unique(readings["plant_id"].astype(str), return_inverse=True)
+    metadata_rows = {plant_id: index for index, plant_id in enumerate(metadata["plant_id"])}
+    missing = [plant_id for plant_id in plant_ids if plant_id not in metadata_rows]
+    if missing:
+        raise ValueError(f"No plant metadata for {missing}")
+    rows = np.array([metadata_rows[plant_id] for plant_id in plant_ids], dtype=int)[inverse]
+
+    columns = dict(readings)
+    for header in METADATA_HEADERS:
+        if header != "plant_id":
+            columns[header] = metadata[header][rows]
+    return columns
+
+
+def write_csv(columns, filename, headers=EXPORT_HEADERS):
+    os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+    length = len(columns["plant_id"])
+    empty = np.full(length, "", dtype=object)
+    with open(filename, 'w', newline='') as output_file:
+        writer = csv.writer(output_file)
+        writer.writerow(headers)
+        writer.writerows(zip(*[columns.get(header, empty) for header in headers]))
+    return length
+
+
+def export(filenames, metadata_filename, output_filename, environment_filename=None, tolerance=None):
+    metadata = load_metadata(metadata_filename)
+    parts = [load_readings(filename) for filename in filenames]
+    if environment_filename is not None:
+        # Only rows without their own ambient readings (normalized soil rows) get the environment's
+        environment = load_csv_readings(environment_filename)
+        parts = [part if all(field in part for field in ENVIRONMENT_FIELDS)
+                 else asof_join(part, environment, tolerance=tolerance) for part in parts]
+    fields = set.intersection(*[set(part) for part in parts]) if parts else {"day", "time", "plant_id"}
+    readings = {field: np.concatenate([part[field] for part in parts]) if parts else np.array([], dtype=object)
+                for field in fields}
+    return write_csv(denormalize(readings, metadata), output_filename)
+
+
+def default_inputs(plant_registry):
+    # Every partition and normalized readings file of the registered plants that exists
+    filenames = []
+    for plant in plant_registry:
+        filenames.extend(find_partitions(os.path.join(os.path.dirname(plant.readings_filename), plant.plant_id)))
+        for filename in [plant.readings_filename, plant.soil_filename, plant.binary_filename]:
+            if os.path.exists(filename):
+                filenames.append(filename)
+    return filenames
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Rebuild the denormalized training csv")
+    parser.add_argument("inputs", nargs="*", help="readings files, defaults to those of the registered plants")
+    parser.add_argument("--config", default=CONFIG_FILENAME)
+    parser.add_argument("--metadata", help="plant metadata table, defaults to the one in the config")
+    parser.add_argument("--output", help="defaults to Plant-Data/training.csv next to the config")
+    parser.add_argument("--environment", help="shared environment readings to join, defaults to the one in the "
+                                              "config when it exists")
+    parser.add_argument("--tolerance", type=float, help="seconds past which no environment reading is joined")
+    args = parser.parse_args()
+
+    plant_registry = PlantRegistry(args.config)
+    filenames = args.inputs or default_inputs(plant_registry)
+    output_filename = args.output or plant_registry.path("Plant-Data/training.csv")
+    environment_filename = args.environment
+    if environment_filename is None and os.path.exists(plant_registry.environment_file):
+        environment_filename = plant_registry.environment_file
+    count = export(filenames, args.metadata or plant_registry.metadata_file, output_filename, environment_filename,
+                   args.tolerance)
+    print(f"Exported {count} readings from {len(filenames)} files to {output_filename}")
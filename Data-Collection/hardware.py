@@ -0,0 +1,230 @@
+"""
+Hardware Backends
+
+Sensors are built through a backend instead of importing board, busio and the Adafruit drivers
+directly. "hardware" is the real Raspberry Pi wiring. "sim" gives deterministic, seeded sensor
+traces with configurable latency, failure rate and RuntimeError injection, so the collection loop,
+calibration and benchmarks run on any Linux box.
+
+The backend is picked by the PLANT_BACKEND environment variable, or "backend" in bot_config.json.
+Simulation settings come from the "sim" section of the config, PLANT_SIM_SEED, PLANT_SIM_LATENCY
+and PLANT_SIM_FAILURE_RATE override the defaults for every sensor.
+"""
+
+import math
+import os
+import random
+import time
+
+
+class HardwareBackend:
+
+    name = "hardware"
+
+
+    def __init__(self, config=None):
+        self.config = config or {}
+
+
+    def make_i2c(self, bus=1):
+        # bus 1 is the header's SCL/SDA, other buses (i2c-gpio overlays, i2c-3...) need adafruit-extended-bus
+        if bus == 1:
+            import board
+            import busio
+            return busio.I2C(board.SCL, board.SDA)
+        try:
+            from adafruit_extended_bus import ExtendedI2C
+        except ImportError:
+            raise ImportError(f"I2C bus {bus} needs the adafruit-extended-bus package") from None
+        return ExtendedI2C(bus)
+
+
+    def make_ads(self, i2c, address=0x48):
+        import adafruit_ads1x15.ads1115 as ADS
+        return ADS.ADS1115(i2c, address=address)
+
+
+    def make_analog_in(self, ads, channel):
+        # channel is the ADS pin name, "P0" to "P3"
+        import adafruit_ads1x15.ads1115 as ADS
+        from adafruit_ads1x15.analog_in import AnalogIn
+        return AnalogIn(ads, getattr(ADS, channel))
+
+
+    def ads_continuous_mode(self):
+        from adafruit_ads1x15.ads1x15 import Mode
+        return Mode.CONTINUOUS
+
+
+    def make_dht(self, pin=12):
+        import adafruit_dht
+        return adafruit_dht.DHT11(pin)
+
+
+    def make_light_sensor(self, i2c, address=0x23):
+        import adafruit_bh1750
+        return adafruit_bh1750.BH1750(i2c, address=address)
+
+
+class SimDevice:
+
+
+    def __init__(self, name, settings):
+        self.name = name
+        self.rng = random.Random(f"{settings['seed']}-{name}")
+        self.latency = settings["latency"]
+        self.failure_rate = settings["failure_rate"]
+        # read numbers (starting at 1) that always fail
+        self.fail_reads = set(settings["fail_reads"])
+        self.step_minutes = settings["step_minutes"]
+        self.reads = 0
+
+
+    def read(self):
+        # Every property access is a bus transaction that may fail
+        self.reads += 1
+        if self.latency:
+            time.sleep(self.latency)
+        if self.reads in self.fail_reads or self.rng.random() < self.failure_rate:
+            raise RuntimeError(f"Simulated {self.name} read failure")
+
+
+    def day_phase(self):
+        # Position in the simulated day, 0 at midnight
+        return (self.reads * self.step_minutes / 1440) % 1
+
+
+class SimI2C:
+
+
+    def __init__(self, backend, bus=1):
+        self.backend = backend
+        self.bus = bus
+
+
+class SimADS1115:
+
+
+    def __init__(self, i2c, address=0x48):
+        self.i2c = i2c
+        self.address = address
+        self.gain = 1
+        self.data_rate = 128
+        self.mode = 1
+
+
+class SimAnalogIn(SimDevice):
+
+
+    def __init__(self, ads, channel, settings):
+        # Bus 1 keeps its original names, and so its seeded traces
+        bus = ads.i2c.bus
+        super().__init__(f"ads-{ads.address:#x}-{channel}" if bus == 1 else f"ads-{bus}-{ads.address:#x}-{channel}",
+                         settings)
+        self.ads = ads
+        self.channel = channel
+        self.level = self.rng.uniform(2.2, 3.0)
+
+
+    @property
+    def voltage(self):
+        self.read()
+        # Soil dries slowly towards the dry voltage and now and then gets watered
+        self.level += self.rng.gauss(0.002, 0.01)
+        if self.level > 3.5 and self.rng.random() < 0.05:
+            self.level = self.rng.uniform(1.95, 2.3)
+        self.level = min(max(self.level, 1.9), 3.85)
+        return self.level
+
+
+class SimDHT11(SimDevice):
+
+
+    def __init__(self, pin, settings):
+        super().__init__(f"dht-{pin}", settings)
+
+
+    @property
+    def temperature(self):
+        self.read()
+        return int(round(21 + 3 * math.sin(2 * math.pi * (self.day_phase() - 0.25)) + self.rng.gauss(0, 0.5)))
+
+
+    @property
+    def humidity(self):
+        self.read()
+        return int(round(55 - 8 * math.sin(2 * math.pi * (self.day_phase() - 0.25)) + self.rng.gauss(0, 1)))
+
+
+class SimBH1750(SimDevice):
+
+
+    def __init__(self, i2c, address, settings):
+        super().__init__(f"bh1750-{address:#x}", settings)
+
+
+    @property
+    def lux(self):
+        self.read()
+        daylight = max(0.0, math.sin(2 * math.pi * (self.day_phase() - 0.25)))
+        return max(0.0, 600 * daylight + self.rng.gauss(0, 5))
+
+
+class SimBackend:
+
+    name = "sim"
+
+
+    def __init__(self, config=None):
+        self.config = config or {}
+        sim = self.config.get("sim", {})
+        self.defaults = {
+            "seed": int(os.environ.get("PLANT_SIM_SEED", sim.get("seed", 0))),
+            "latency": float(os.environ.get("PLANT_SIM_LATENCY", sim.get("latency", 0.0))),
+            "failure_rate": float(os.environ.get("PLANT_SIM_FAILURE_RATE", sim.get("failure_rate", 0.0))),
+            "fail_reads": sim.get("fail_reads", []),
+            "step_minutes": sim.get("step_minutes", 30),
+        }
+        # Per sensor overrides: "ads", "dht" and "light"
+        self.sensors = sim.get("sensors", {})
+
+
+    def settings(self, kind):
+        settings = dict(self.defaults)
+        settings.update(self.sensors.get(kind, {}))
+        return settings
+
+
+    def make_i2c(self, bus=1):
+        return SimI2C(self, bus)
+
+
+    def make_ads(self, i2c, address=0x48):
+        return SimADS1115(i2c, address)
+
+
+    def make_analog_in(self, ads, channel):
+        return SimAnalogIn(ads, channel, self.settings("ads"))
+
+
+    def ads_continuous_mode(self):
+        return 0
+
+
+    def make_dht(self, pin=12):
+        return SimDHT11(pin, self.settings("dht"))
+
+
+    def make_light_sensor(self, i2c, address=0x23):
+        return SimBH1750(i2c, address, self.settings("light"))
+
+
+BACKENDS = {"hardware": HardwareBackend, "sim": SimBackend}
+
+
+def get_backend(config=None):
+    config = config or {}
+    name = os.environ.get("PLANT_BACKEND") or config.get("backend", "hardware")
+    if name not in BACKENDS:
+        raise ValueError(f"Unknown backend {name}, expected one of {list(BACKENDS)}")
+    return BACKENDS[name](config)
@@ -0,0 +1,102 @@
+"""
+Interval Scheduler
+
+Runs the collection loop on wall-clock aligned boundaries (xx:00, xx:30 for 30 minute intervals)
+without drift. Sleeps are measured on time.monotonic, so the time the cycle itself took is always
+accounted for and sub-second intervals work. A cycle that overruns the next boundary by more than
+`grace` (half an interval by default) does not slide the schedule: the missed ticks are logged as a
+gap and the loop carries on at the next boundary. A tick only a little late still runs.
+The wall clock is only used to pick boundaries, and a clock step (NTP sync on a Pi without RTC) is
+detected and realigned to.
+"""
+
+import datetime
+import math
+import time
+from utils import printlog
+
+
+class IntervalScheduler:
+
+
+    def __init__(self, interval_seconds, clock_step_tolerance=1.0, grace=0.5, name=None):
+        self.interval = interval_seconds
+        # What the ticks are for in the missed interval log, e.g. a multi-rate stream
+        self.name = name
+        self.clock_step_tolerance = clock_step_tolerance
+        # Fraction of the interval a tick may run late before it counts as missed
+        self.grace = grace * interval_seconds
+        self.offset = self.clock_offset()
+        # Wall time of the upcoming tick
+        self.next_tick = None
+        self.missed_ticks = 0
+
+
+    def clock_offset(self):
+        return time.time() - time.monotonic()
+
+
+    def next_boundary(self, wall_time):
+        # Boundaries are aligned to local time, so 30 minutes lands on xx:00 and xx:30
+        utc_offset = datetime.datetime.fromtimestamp(wall_time).astimezone().utcoffset().total_seconds()
+        local_time = wall_time + utc_offset
+        return (math.floor(local_time / self.interval) + 1) * self.interval - utc_offset
+
+
+    def check_clock(self):
+        offset = self.clock_offset()
+        if abs(offset - self.offset) > self.clock_step_tolerance:
+            printlog(f"Wall clock stepped by {offset - self.offset:.1f}s, realigning schedule")
+            self.offset = offset
+            self.next_tick = None
+
+
+    def peek(self):
+        # Monotonic time of the upcoming tick
+        self.check_clock()
+        if self.next_tick is None:
+            self.next_tick = self.next_boundary(time.time())
+        return self.next_tick - self.offset
+
+
+    def due(self):
+        # Monotonic time of the upcoming tick, ticks the loop already ran past are skipped and logged
+        deadline = self.peek()
+        now = time.monotonic()
+        if now > deadline + self.grace:
+            # The cycle ran well past one or more ticks, skip them instead of running late
+            missed = math.ceil((now - deadline - self.grace) / self.interval)
+            gap_start = datetime.datetime.fromtimestamp(self.next_tick)
+            self.missed_ticks += missed
+            self.next_tick += missed * self.interval
+            deadline += missed * self.interval
+            of = f" of {self.name}" if self.name else ""
+            printlog(f"!!! Missed {missed} interval(s){of} from {gap_start:%Y-%m-%d %H:%M:%S}, cycle overran !!!")
+        return deadline
+
+
+    def advance(self):
+        # Consume the upcoming tick and return its wall time
+        tick = self.next_tick
+        self.next_tick += self.interval
+        return tick
+
+
+    def wait(self):
+        # Sleep until the upcoming tick and return its wall time
+        deadline = self.due()
+        remaining = deadline - time.monotonic()
+        if remaining > 0:
+            if self.interval >= 10:
+                print(f"\nNext interval in {remaining:.1f} seconds")
+            sleep_until(deadline)
+        return self.advance()
+
+
+def sleep_until(deadline):
+    # sleep can wake up a little early, never return before the monotonic deadline
+    while True:
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            return
+        time.sleep(remaining)
@@ -0,0 +1,206 @@
+"""
+Live Feed
+
+Latest readings of every plant and of the environment sensors, published by the collector in a
+fixed-layout System V shared memory segment. Local consumers (the LCD/keypad UI, a watering
+controller) read them straight from memory, without rereading the csv files or touching the bus.
+
+The segment is a header, the environment record and one slot per plant. A sequence number in the
+header is odd while the collector is writing (a seqlock): readers unpack the values in place and
+keep them only if the sequence was even and unchanged around the read, otherwise they read again.
+Missing values are NaN in the segment and None in a snapshot.
+
+    python live_feed.py             prints the current snapshot
+"""
+
+import argparse
+import math
+import struct
+import threading
+import time
+from collections import namedtuple
+import sysv_ipc
+
+
+FEED_KEY = 0x504C4E54   # "PLNT", the segment readers attach to by default
+MAGIC = b"PLANTFED"
+VERSION = 1
+# magic, version, plant count, segment size, sequence, published at
+HEADER = struct.Struct("<8sHHIQd")
+SEQUENCE = struct.Struct("<Q")
+SEQUENCE_OFFSET = 16
+# lux, light read at, temperature, humidity, air read at
+ENVIRONMENT = struct.Struct("<ddddd")
+ENVIRONMENT_FIELDS = ["lux", "light_at", "temperature", "humidity", "air_at"]
+# plant_id, soil_moisture_percent, was_watered, ml, read at
+PLANT_ID_BYTES = 24
+PLANT = struct.Struct(f"<{PLANT_ID_BYTES}sdddd")
+PLANT_FIELDS = ["soil_moisture_percent", "was_watered", "ml", "read_at"]
+
+Snapshot = namedtuple("Snapshot", ["sequence", "published_at", "environment", "plants"])
+
+
+def segment_size(plant_count):
+    return HEADER.size + ENVIRONMENT.size + plant_count * PLANT.size
+
+
+def plant_offset(index):
+    return HEADER.size + ENVIRONMENT.size + index * PLANT.size
+
+
+def number(value):
+    # None and empty csv values are NaN in the segment
+    if value is None or value == "":
+        return math.nan
+    return float(value)
+
+
+def value(stored):
+    return None if math.isnan(stored) else stored
+
+
+class LiveFeedWriter:
+
+
+    def __init__(self, plant_ids, key=FEED_KEY, mode=0o644):
+        self.plant_ids = list(plant_ids)
+        self.slots = {plant_id: index for index, plant_id in enumerate(self.plant_ids)}
+        for plant_id in self.plant_ids:
+            if len(plant_id.encode()) > PLANT_ID_BYTES:
+                raise ValueError(f"Plant id {plant_id} is too long for the live feed")
+        self.size = segment_size(len(self.plant_ids))
+        self.lock = threading.Lock()
+        self.memory = self.open_segment(key, mode)
+        self.buffer = memoryview(self.memory)
+
+        # Carry on the sequence of an earlier run, so readers never see it go back
+        magic, version, _, size, sequence, _ = HEADER.unpack_from(self.buffer)
+        self.sequence = sequence + sequence % 2 if (magic, version, size) == (MAGIC, VERSION, self.size) else 0
+        self.environment = [math.nan] * len(ENVIRONMENT_FIELDS)
+        self.plants = [[math.nan] * len(PLANT_FIELDS) for _ in self.plant_ids]
+        with self.lock:
+            self.begin()
+            HEADER.pack_into(self.buffer, 0, MAGIC, VERSION, len(self.plant_ids), self.size, self.sequence, 0.0)
+            ENVIRONMENT.pack_into(self.buffer, HEADER.size, *self.environment)
+            for index, plant_id in enumerate(self.plant_ids):
+                PLANT.pack_into(self.buffer, plant_offset(index), plant_id.encode(), *self.plants[index])
+            self.end(0.0)
+
+
+    def open_segment(self, key, mode):
+        try:
+            memory = sysv_ipc.SharedMemory(key)
+            if memory.size == self.size:
+                return memory
+            # Left by a run with another number of plants, readers still attached keep the old one
+            memory.detach()
+            memory.remove()
+        except sysv_ipc.ExistentialError:
+            pass
+        return sysv_ipc.SharedMemory(key, sysv_ipc.IPC_CREAT, mode, self.size)
+
+
+    def begin(self):
+        # Odd sequence: readers retry until the write is over
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+
+    def end(self, published_at):
+        struct.pack_into("<d", self.buffer, SEQUENCE_OFFSET + SEQUENCE.size, published_at)
+        self.sequence += 1
+        SEQUENCE.pack_into(self.buffer, SEQUENCE_OFFSET, self.sequence)
+
+
+    def publish(self, environment=None, plants=None, timestamp=None):
+        # environment: any of lux, temperature and humidity, plants: plant_id -> any of the plant fields
+        timestamp = time.time() if timestamp is None else timestamp
+        with self.lock:
+            self.begin()
+            if environment:
+                if "lux" in environment:
+                    self.environment[0:2] = [number(environment["lux"]), timestamp]
+                if "temperature" in environment or "humidity" in environment:
+                    self.environment[2:5] = [number(environment.get("temperature")),
+                                             number(environment.get("humidity")), timestamp]
+                ENVIRONMENT.pack_into(self.buffer, HEADER.size, *self.environment)
+            for plant_id, values in (plants or {}).items():
+                index = self.slots[plant_id]
+                slot = self.plants[index]
+                for position, field in enumerate(PLANT_FIELDS[:-1]):
+                    if field in values:
+                        slot[position] = number(values[field])
+                slot[-1] = timestamp
+                PLANT.pack_into(self.buffer, plant_offset(index), plant_id.encode(), *slot)
+            self.end(timestamp)
+
+
+    def close(self, remove=False):
+        # The segment stays by default, consumers keep the last readings and can tell their age
+        self.buffer.release()
+        self.memory.detach()
+        if remove:
+            self.memory.remove()
+
+
+class LiveFeedReader:
+
+
+    def __init__(self, key=FEED_KEY):
+        # Raises sysv_ipc.ExistentialError when no collector has published yet
+        self.memory = sysv_ipc.SharedMemory(key)
+        self.buffer = memoryview(self.memory)
+        magic, version, plant_count, size, _, _ = HEADER.unpack_from(self.buffer)
+        if magic != MAGIC or version != VERSION or size != len(self.buffer):
+            raise ValueError(f"Shared memory {key:#x} is not a version {VERSION} live feed")
+        # Slots never move once the segment is made
+        self.plant_ids = [PLANT.unpack_from(self.buffer, plant_offset(index))[0].rstrip(b"\0").decode()
+                          for index in range(plant_count)]
+
+
+    def sequence(self):
+        # Changes with every publish, cheap to poll before taking a snapshot
+        return SEQUENCE.unpack_from(self.buffer, SEQUENCE_OFFSET)[0]
+
+
+    def snapshot(self, retries=1000):
+        for _ in range(retries):
+            before = self.sequence()
+            if before % 2 == 0:
+                _, _, _, _, _, published_at = HEADER.unpack_from(self.buffer)
+                environment = ENVIRONMENT.unpack_from(self.buffer, HEADER.size)
+                plants = [PLANT.unpack_from(self.buffer, plant_offset(index))[1:]
+                          for index in range(len(self.plant_ids))]
+                if self.sequence() == before:
+                    break
+            # A publish is in progress, it only takes microseconds
+            time.sleep(0)
+        else:
+            raise RuntimeError(f"No consistent live feed snapshot after {retries} tries")
+
+        plants = {plant_id: {field: value(stored) for field, stored in zip(PLANT_FIELDS, values)}
+                  for plant_id, values in zip(self.plant_ids, plants)}
+        for values in plants.values():
+            if values["was_watered"] is not None:
+                values["was_watered"] = bool(values["was_watered"])
+        return Snapshot(before, value(published_at) or None,
+                        {field: value(stored) for field, stored in zip(ENVIRONMENT_FIELDS, environment)}, plants)
+
+
+    def close(self):
+        self.buffer.release()
+        self.memory.detach()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Latest readings published by the collector")
+    parser.add_argument("--key", type=lambda key: int(key, 0), default=FEED_KEY)
+    args = parser.parse_args()
+
+    reader = LiveFeedReader(args.key)
+    snapshot = reader.snapshot()
+    reader.close()
+    print(f"Sequence {snapshot.sequence}, published at {time.ctime(snapshot.published_at) if snapshot.published_at else 'never'}")
+    print(", ".join(f"{field} {snapshot.environment[field]}" for field in ["lux", "temperature", "humidity"]))
+    for plant_id, values in snapshot.plants.items():
+        print(f"{plant_id}: " + ", ".join(f"{field} {values[field]}" for field in PLANT_FIELDS[:-1]))
@@ -0,0 +1,171 @@
+"""
+Sensor Metrics
+
+Per sensor read latency histograms, retry and failure counts and the time of the last successful
+read, exported in Prometheus text format. Recording is a bisect and a few integer updates under a
+lock, so it can sit in the hot read path. The metrics are written to a file every cycle (for the
+node_exporter textfile collector) and can also be served from a small local HTTP endpoint.
+"""
+
+import bisect
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+# Upper bounds in seconds, a DHT11 read takes ~0.25 s and retries wait seconds
+BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0)
+
+
+class SensorStats:
+
+
+    def __init__(self):
+        self.buckets = [0] * (len(BUCKETS) + 1)
+        self.latency_sum = 0.0
+        self.attempts = 0
+        self.attempt_failures = 0
+        self.reads = 0
+        self.read_failures = 0
+        self.retries = 0
+        self.last_success = None
+
+
+class SensorMetrics:
+
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.sensors = {}
+        # name -> (help text, {label value: value}) of gauges set by other components, e.g. the write queue
+        self.gauges = {}
+        self.server = None
+
+
+    def stats(self, sensor):
+        stats = self.sensors.get(sensor)
+        if stats is None:
+            stats = self.sensors[sensor] = SensorStats()
+        return stats
+
+
+    def record_attempt(self, sensor, seconds, ok):
+        # One hardware read, successful or not
+        with self.lock:
+            stats = self.stats(sensor)
+            stats.buckets[bisect.bisect_left(BUCKETS, seconds)] += 1
+            stats.latency_sum += seconds
+            stats.attempts += 1
+            if not ok:
+                stats.attempt_failures += 1
+
+
+    def timed(self, sensor, read):
+        # read() recording every call as a hardware attempt, wraps the read behind any cache
+
+        def timed_read():
+            start = time.perf_counter()
+            try:
+                value = read()
+            except Exception:
+                self.record_attempt(sensor, time.perf_counter() - start, False)
+                raise
+            self.record_attempt(sensor, time.perf_counter() - start, True)
+            return value
+        return timed_read
+
+
+    def record_result(self, sensor, attempts, ok):
+        # Outcome of a read after its retries
+        with self.lock:
+            stats = self.stats(sensor)
+            stats.reads += 1
+            stats.retries += max(0, attempts - 1)
+            if ok:
+                stats.last_success = time.time()
+            else:
+                stats.read_failures += 1
+
+
+    def set_gauge(self, name, help_text, value, label=None):
+        # label is the value of the sensor label, None for a bot-wide gauge
+        with self.lock:
+            self.gauges.setdefault(name, (help_text, {}))[1][label] = value
+
+
+    def render(self):
+        with self.lock:
+            sensors = sorted(self.sensors.items())
+            lines = [
+                "# HELP plant_sensor_read_seconds Latency of a single sensor read attempt.",
+                "# TYPE plant_sensor_read_seconds histogram",
+            ]
+            for sensor, stats in sensors:
+                cumulative = 0
+                for bound, count in zip(BUCKETS + ("+Inf",), stats.buckets):
+                    cumulative += count
+                    lines.append(f'plant_sensor_read_seconds_bucket{{sensor="{sensor}",le="{bound}"}} {cumulative}')
+                lines.append(f'plant_sensor_read_seconds_sum{{sensor="{sensor}"}} {stats.latency_sum}')
+                lines.append(f'plant_sensor_read_seconds_count{{sensor="{sensor}"}} {stats.attempts}')
+
+            counters = [
+                ("plant_sensor_reads_total", "Sensor reads including their retries.", "reads"),
+                ("plant_sensor_read_failures_total", "Sensor reads that failed after every retry.", "read_failures"),
+                ("plant_sensor_retries_total", "Retry attempts made after a failed read.", "retries"),
+                ("plant_sensor_attempt_failures_total", "Single read attempts that raised an error.", "attempt_failures"),
+            ]
+            for name, help_text, field in counters:
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} counter")
+                for sensor, stats in sensors:
+                    lines.append(f'{name}{{sensor="{sensor}"}} {getattr(stats, field)}')
+
+            lines.append("# HELP plant_sensor_last_success_timestamp_seconds Unix time of the last successful read.")
+            lines.append("# TYPE plant_sensor_last_success_timestamp_seconds gauge")
+            for sensor, stats in sensors:
+                if stats.last_success is not None:
+                    lines.append(f'plant_sensor_last_success_timestamp_seconds{{sensor="{sensor}"}} {stats.last_success}')
+
+            for name, (help_text, values) in sorted(self.gauges.items()):
+                lines.append(f"# HELP {name} {help_text}")
+                lines.append(f"# TYPE {name} gauge")
+                for label, value in sorted(values.items(), key=lambda item: str(item[0])):
+                    lines.append(f"{name} {value}" if label is None else f'{name}{{sensor="{label}"}} {value}')
+        return "\n".join(lines) + "\n"
+
+
+    def write(self, filename):
+        # Write then rename, a scraper never sees a half written file
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, 'w') as metrics_file:
+            metrics_file.write(self.render())
+        os.replace(temp_filename, filename)
+
+
+    def serve(self, port, host="127.0.0.1"):
+        metrics = self
+
+        class MetricsHandler(BaseHTTPRequestHandler):
+
+            def do_GET(self):
+                body = metrics.render().encode()
+                self.send_response(200)
+                self.send_header("Content-Type", "text/plain; version=0.0.4")
+                self.send_header("Content-Length", str(len(body)))
+                self.end_headers()
+                self.wfile.write(body)
+
+            def log_message(self, format, *args):
+                pass
+
+        self.server = ThreadingHTTPServer((host, port), MetricsHandler)
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        return self.server
+
+
+    def close(self):
+        if self.server is not None:
+            self.server.shutdown()
+            self.server.server_close()
+            self.server = None
@@ -0,0 +1,64 @@
+"""
+Multi-Rate Scheduler
+
+Samples every sensor stream on its own period, light every second, air every minute and each soil
+channel every half hour for example. Every stream is aligned to wall-clock boundaries of its period
+through its own IntervalScheduler, and streams of the same group that fall due within
+`coalesce_window` seconds of each other are handed back as one batch so their reads share a single
+bus transaction window. The I2C sensors share a group, the DHT11 has its own so its slow, retried
+reads are never batched with them. Every stream keeps the wall time of the tick it was due for,
+which its rows are stamped with.
+"""
+
+from interval_scheduler import IntervalScheduler, sleep_until
+
+
+class Stream:
+
+
+    def __init__(self, name, period, reads, headers, filename, group="i2c"):
+        self.name = name
+        self.period = period
+        self.group = group
+        # {read name: single attempt read}, run through the retry scheduler
+        self.reads = reads
+        self.headers = headers
+        self.filename = filename
+        self.scheduler = IntervalScheduler(period, name=name)
+        # Wall time of the tick of the last batch
+        self.tick = None
+
+
+class MultiRateScheduler:
+
+
+    def __init__(self, streams, coalesce_window=0.05):
+        self.streams = streams
+        self.coalesce_window = coalesce_window
+
+
+    def wait(self):
+        # Sleep until the earliest stream is due, return the streams due in the same window, one batch per group
+        deadlines = [(stream.scheduler.due(), stream) for stream in self.streams]
+        first = min(deadline for deadline, _ in deadlines)
+        sleep_until(first)
+
+        batches = {}
+        for deadline, stream in deadlines:
+            if deadline <= first + self.coalesce_window:
+                stream.tick = stream.scheduler.advance()
+                batches.setdefault(stream.group, []).append(stream)
+        return list(batches.values())
+
+
+    def reads(self, batch):
+        # All reads of a batch, to be run together
+        reads = {}
+        for stream in batch:
+            reads.update(stream.reads)
+        return reads
+
+
+    def deadlines(self, batch, cycle_deadline):
+        # Every read retries until its own stream is next due, the cycle deadline at most
+        return {name: min(stream.period, cycle_deadline) for stream in batch for name in stream.reads}
@@ -0,0 +1,106 @@
+"""
+Oversampler
+
+Aggregates high-rate sensor samples over a logging interval into mean, median, min, max, std and
+sample count. Every field keeps a fixed-size float32 buffer: mean, std, min, max and count are
+exact running values, while the buffer is decimated by two whenever it fills so the median is
+taken from an evenly spread subset. Memory use is the same however long the interval is.
+"""
+
+import math
+import numpy as np
+
+
+AGGREGATES = ["mean", "median", "min", "max", "std", "count"]
+
+
+def aggregate_headers(headers, fields):
+    # Expand every sampled field of the headers schema into one column per aggregate
+    expanded = []
+    for header in headers:
+        if header in fields:
+            expanded.extend(f"{header}_{aggregate}" for aggregate in AGGREGATES)
+        else:
+            expanded.append(header)
+    return expanded
+
+
+class IntervalBuffer:
+
+
+    def __init__(self, capacity=1024):
+        if capacity < 2:
+            raise ValueError(f"IntervalBuffer capacity must be at least 2 samples, got {capacity}")
+        self.samples = np.empty(capacity, dtype=np.float32)
+        self.reset()
+
+
+    def reset(self):
+        self.size = 0
+        self.stride = 1
+        self.skipped = 0
+        self.count = 0
+        self.mean = 0.0
+        self.m2 = 0.0
+        self.min = math.inf
+        self.max = -math.inf
+
+
+    def add(self, value):
+        if value is None or math.isnan(value):
+            return
+        # Running statistics (Welford) over every sample
+        self.count += 1
+        delta = value - self.mean
+        self.mean += delta / self.count
+        self.m2 += delta * (value - self.mean)
+        self.min = min(self.min, value)
+        self.max = max(self.max, value)
+
+        # Keep every stride-th sample for the median, halving the buffer when full
+        self.skipped += 1
+        if self.skipped < self.stride:
+            return
+        self.skipped = 0
+        if self.size == len(self.samples):
+            # Every other sample, one more than half of an odd capacity
+            kept = (self.size + 1) // 2
+            self.samples[:kept] = self.samples[:self.size:2]
+            self.size = kept
+            self.stride *= 2
+        self.samples[self.size] = value
+        self.size += 1
+
+
+    def aggregate(self):
+        if self.count == 0:
+            return {**dict.fromkeys(AGGREGATES, None), "count": 0}
+        return {
+            "mean": round(self.mean, 2),
+            "median": round(float(np.median(self.samples[:self.size])), 2),
+            "min": round(self.min, 2),
+            "max": round(self.max, 2),
+            "std": round(math.sqrt(self.m2 / self.count), 2),
+            "count": self.count,
+        }
+
+
+class IntervalAggregator:
+
+
+    def __init__(self, fields, capacity=1024):
+        self.buffers = {field: IntervalBuffer(capacity) for field in fields}
+
+
+    def add(self, field, value):
+        self.buffers[field].add(value)
+
+
+    def aggregate(self, field):
+        # Columns named like aggregate_headers
+        return {f"{field}_{name}": value for name, value in self.buffers[field].aggregate().items()}
+
+
+    def reset(self):
+        for buffer in self.buffers.values():
+            buffer.reset()
@@ -0,0 +1,230 @@
+"""
+Partitions
+
+Splits the readings of every plant into time partitions, Plant-Data/<plant_id>/<YYYY-MM-DD>.csv by
+default, so no file grows without bound and a corrupted file only costs one partition. A partition
+is closed when the first reading of the next one arrives (at midnight for day partitions), then
+compressed with lzma or gzip on a background thread so the collection cycle never waits for it.
+
+Every plant directory keeps a manifest.json with the rows, first and last reading and file of each
+partition, so readers can go straight to the partitions they need. It is rewritten when a partition
+is opened and after every flush, and partitions missing from it are still found on disk.
+"""
+
+import gzip
+import json
+import lzma
+import os
+import shutil
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from utils import printlog
+
+
+MANIFEST_FILENAME = "manifest.json"
+DATA_EXTENSIONS = (".csv", ".bin")
+# Characters of the day column kept in the partition key
+PARTITION_KEYS = {"day": 10, "month": 7, "year": 4}
+COMPRESSORS = {"lzma": (lzma.open, ".xz"), "gzip": (gzip.open, ".gz")}
+
+
+def partition_key(day, period="day"):
+    return day[:PARTITION_KEYS[period]]
+
+
+def open_partition(filename, mode='rb'):
+    # Partitions are read the same way whether they were compressed yet or not
+    for opener, extension in COMPRESSORS.values():
+        if filename.endswith(extension):
+            return opener(filename, mode)
+    return open(filename, mode)
+
+
+def load_manifest(directory):
+    try:
+        with open(os.path.join(directory, MANIFEST_FILENAME), 'r') as manifest_file:
+            return json.load(manifest_file)
+    except FileNotFoundError:
+        return {"partitions": {}}
+
+
+def list_partitions(directory):
+    # Partition key -> file of the partitions on disk, for the ones a crash kept out of the manifest
+    partitions = {}
+    if not os.path.isdir(directory):
+        return partitions
+    for name in sorted(os.listdir(directory)):
+        base = name
+        for _, extension in COMPRESSORS.values():
+            if base.endswith(extension):
+                base = base[:-len(extension)]
+        key, extension = os.path.splitext(base)
+        if extension in DATA_EXTENSIONS:
+            partitions.setdefault(key, name)
+    return partitions
+
+
+def find_partitions(directory, start=None, end=None):
+    # Files of the partitions with a key between start and end (inclusive), e.g. "2024-03-01"
+    partitions = list_partitions(directory)
+    for key, entry in load_manifest(directory)["partitions"].items():
+        if os.path.exists(os.path.join(directory, entry["filename"])) or key not in partitions:
+            partitions[key] = entry["filename"]
+    return [os.path.join(directory, partitions[key]) for key in sorted(partitions)
+            if (start is None or key >= start[:len(key)]) and (end is None or key <= end[:len(key)])]
+
+
+def compress_file(filename, method="lzma"):
+    opener, extension = COMPRESSORS[method]
+    compressed_filename = filename + extension
+    temp_filename = compressed_filename + ".tmp"
+    with open(filename, 'rb') as source, opener(temp_filename, 'wb') as target:
+        shutil.copyfileobj(source, target)
+    os.replace(temp_filename, compressed_filename)
+    os.remove(filename)
+    return compressed_filename
+
+
+class PartitionedWriter:
+
+
+    def __init__(self, writer, period="day", compress="lzma"):
+        # writer is the DataWriter (or BinaryLogWriter) the partitions are written with
+        self.writer = writer
+        self.period = period
+        self.compress = compress
+        self.current = {}
+        self.closing = []
+        self.manifests = {}
+        self.manifest_lock = threading.Lock()
+        # A single worker, compression runs one partition at a time at low priority to the cycle
+        self.executor = ThreadPoolExecutor(max_workers=1)
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    @property
+    def pending_rows(self):
+        return self.writer.pending_rows
+
+
+    def partition_filename(self, filename, data):
+        directory = os.path.join(os.path.dirname(filename), data["plant_id"])
+        return os.path.join(directory, partition_key(data["day"], self.period) + os.path.splitext(filename)[1])
+
+
+    def manifest(self, directory):
+        if directory not in self.manifests:
+            self.manifests[directory] = load_manifest(directory)
+            # Partitions left open by an earlier run are cold already
+            for key, entry in self.manifests[directory]["partitions"].items():
+                if not entry["compressed"]:
+                    self.closing.append(os.path.join(directory, entry["filename"]))
+        return self.manifests[directory]
+
+
+    def write_manifest(self, directory):
+        filename = os.path.join(directory, MANIFEST_FILENAME)
+        temp_filename = filename + ".tmp"
+        with open(temp_filename, 'w') as manifest_file:
+            json.dump(self.manifests[directory], manifest_file, indent=4, sort_keys=True)
+        os.replace(temp_filename, filename)
+
+
+    def write_manifests(self):
+        with self.manifest_lock:
+            for directory in self.manifests:
+                self.write_manifest(directory)
+
+
+    def record(self, filename, data):
+        directory, name = os.path.split(filename)
+        key = os.path.splitext(name)[0]
+        with self.manifest_lock:
+            partitions = self.manifest(directory)["partitions"]
+            if key not in partitions:
+                # On disk before any row of the partition, so recovery after a crash finds it
+                partitions[key] = {"filename": name, "rows": 0, "first": None, "compressed": False}
+                self.write_manifest(directory)
+            entry = partitions[key]
+            moment = f"{data['day']} {data['time']}"
+            entry["first"] = entry["first"] or moment
+            entry["last"] = moment
+            entry["rows"] += 1
+
+
+    def write(self, filename, data, headers=None):
+        partition_filename = self.partition_filename(filename, data)
+        previous = self.current.get(filename)
+        if previous != partition_filename:
+            os.makedirs(os.path.dirname(partition_filename), exist_ok=True)
+            self.current[filename] = partition_filename
+            if previous is not None:
+                printlog(f"Rotating {previous} -> {partition_filename}")
+                self.closing.append(previous)
+        self.record(partition_filename, data)
+        self.writer.write(partition_filename, data, headers)
+        self.rotate()
+
+
+    def rotate(self):
+        # Close finished partitions once their rows are on disk, then compress them in the background
+        open_partitions = set(self.current.values())
+        closing, self.closing = self.closing, []
+        for filename in closing:
+            if filename in open_partitions:
+                continue
+            if not self.writer.close_file(filename):
+                self.closing.append(filename)
+                continue
+            with self.manifest_lock:
+                self.write_manifest(os.path.dirname(filename))
+            if self.compress and os.path.exists(filename):
+                self.executor.submit(self.compress_partition, filename)
+
+
+    def compress_partition(self, filename):
+        try:
+            compressed_filename = compress_file(filename, self.compress)
+        except OSError as e:
+            printlog(f"Error compressing {filename}: {e}")
+            return
+        directory, name = os.path.split(filename)
+        with self.manifest_lock:
+            entry = self.manifest(directory)["partitions"][os.path.splitext(name)[0]]
+            entry.update(filename=os.path.basename(compressed_filename), compressed=True)
+            self.write_manifest(directory)
+
+
+    def flush_due(self):
+        return self.writer.flush_due()
+
+
+    def flush_if_due(self):
+        last_flush = self.writer.last_flush
+        flushed = self.writer.flush_if_due()
+        if self.writer.last_flush != last_flush:
+            # The manifest follows the rows on disk
+            self.write_manifests()
+        return flushed
+
+
+    def flush(self):
+        flushed = self.writer.flush()
+        self.write_manifests()
+        return flushed
+
+
+    def close(self):
+        # Open partitions stay uncompressed, the next run keeps appending to them
+        self.rotate()
+        flushed = self.flush()
+        self.writer.close()
+        self.executor.shutdown()
+        return flushed
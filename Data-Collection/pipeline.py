@@ -0,0 +1,194 @@
+"""
+Write Pipeline
+
+Moves persistence off the sampling thread: the collection loop puts each cycle's rows on a
+bounded queue and a writer thread logs them, so a slow SD card write never delays the next
+sample. When the queue is full the policy decides what gives:
+
+    block        the loop waits for the writer (backpressure, nothing is lost)
+    drop_oldest  the oldest queued cycle is dropped to make room
+    spill        the cycle is appended to a spill file and written once the queue drains
+
+Queue depth, the lag between queuing and writing, and dropped and spilled cycles are kept in
+`stats()` and exported as metrics.
+"""
+
+import json
+import os
+import queue
+import threading
+import time
+from utils import printlog
+
+
+POLICIES = ["block", "drop_oldest", "spill"]
+
+
+class WritePipeline:
+
+
+    def __init__(self, consume, maxsize=64, policy="block", spill_filename=None, metrics=None):
+        if policy not in POLICIES:
+            raise ValueError(f"Unknown queue policy {policy}, expected one of {POLICIES}")
+        if policy == "spill" and spill_filename is None:
+            raise ValueError("The spill policy needs a spill_filename")
+        self.consume = consume
+        self.policy = policy
+        self.spill_filename = spill_filename
+        self.metrics = metrics
+        self.queue = queue.Queue(maxsize)
+        self.lock = threading.Lock()
+        self.spilled = 0
+        self.spill_pending = 0
+        self.dropped = 0
+        self.consumed = 0
+        self.max_depth = 0
+        self.lag = 0.0
+        self.max_lag = 0.0
+        if spill_filename is not None and os.path.exists(spill_filename):
+            # Cycles spilled by an earlier run that never got written
+            with open(spill_filename, 'r') as spill_file:
+                self.spill_pending = sum(1 for _ in spill_file)
+        self.thread = threading.Thread(target=self.run, name="write-pipeline", daemon=True)
+        self.thread.start()
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def put(self, item):
+        # item must be JSON-able for the spill policy
+        entry = (time.time(), item)
+        if self.policy == "block":
+            self.queue.put(entry)
+        elif self.policy == "drop_oldest":
+            while True:
+                try:
+                    self.queue.put_nowait(entry)
+                    break
+                except queue.Full:
+                    try:
+                        self.queue.get_nowait()
+                        self.queue.task_done()
+                        with self.lock:
+                            self.dropped += 1
+                        printlog("!!! Write queue full, dropped the oldest cycle !!!")
+                    except queue.Empty:
+                        pass
+        else:
+            with self.lock:
+                # Once anything is spilled, later cycles follow it so the order is kept
+                spill = self.spill_pending > 0
+                if not spill:
+                    try:
+                        self.queue.put_nowait(entry)
+                    except queue.Full:
+                        spill = True
+                if spill:
+                    self.spill(entry)
+        self.update_stats()
+
+
+    def spill(self, entry):
+        with open(self.spill_filename, 'a') as spill_file:
+            spill_file.write(json.dumps([entry[0], entry[1]], separators=(",", ":")) + "\n")
+            # A spilled cycle is only in this file, it must survive a power cut
+            spill_file.flush()
+            os.fsync(spill_file.fileno())
+        self.spilled += 1
+        self.spill_pending += 1
+
+
+    def drain_spill(self):
+        # Cycles spilled to disk, oldest first, once the queue is empty
+        with self.lock:
+            if self.spill_pending == 0:
+                return []
+            entries = []
+            with open(self.spill_filename, 'r', errors='replace') as spill_file:
+                for number, line in enumerate(spill_file, 1):
+                    try:
+                        if not line.endswith("\n"):
+                            raise ValueError("torn line")
+                        entries.append(tuple(json.loads(line)))
+                    except ValueError as e:
+                        printlog(f"Skipping line {number} of {self.spill_filename}: {e}")
+            os.remove(self.spill_filename)
+            self.spill_pending = 0
+        return entries
+
+
+    def write_spilled(self):
+        try:
+            spilled = self.drain_spill()
+        except Exception as e:
+            # The spill file stays and is tried again once the queue next drains
+            printlog(f"Error reading the spilled data: {e}")
+            return
+        for entry in spilled:
+            self.write(entry)
+
+
+    def run(self):
+        self.write_spilled()
+        while True:
+            entry = self.queue.get()
+            if entry is None:
+                self.queue.task_done()
+                break
+            try:
+                self.write(entry)
+                if self.queue.empty():
+                    self.write_spilled()
+            except Exception as e:
+                # Nothing may stop the writer thread, or the queue would never drain again
+                printlog(f"Error in the write pipeline: {e}")
+            finally:
+                self.queue.task_done()
+
+
+    def write(self, entry):
+        queued, item = entry
+        try:
+            self.consume(item)
+        except Exception as e:
+            # A failed write must not stop the writer thread
+            printlog(f"Error writing queued data: {e}")
+        with self.lock:
+            self.consumed += 1
+            self.lag = time.time() - queued
+            self.max_lag = max(self.max_lag, self.lag)
+        self.update_stats()
+
+
+    def stats(self):
+        with self.lock:
+            return {"depth": self.queue.qsize(), "max_depth": self.max_depth, "lag": self.lag,
+                    "max_lag": self.max_lag, "consumed": self.consumed, "dropped": self.dropped,
+                    "spilled": self.spilled, "spill_pending": self.spill_pending}
+
+
+    def update_stats(self):
+        with self.lock:
+            self.max_depth = max(self.max_depth, self.queue.qsize())
+        if self.metrics is not None:
+            stats = self.stats()
+            self.metrics.set_gauge("plant_write_queue_depth", "Cycles waiting to be written.", stats["depth"])
+            self.metrics.set_gauge("plant_write_queue_lag_seconds", "Time the last written cycle spent queued.",
+                                   stats["lag"])
+            self.metrics.set_gauge("plant_write_queue_dropped", "Cycles dropped because the queue was full.",
+                                   stats["dropped"])
+            self.metrics.set_gauge("plant_write_queue_spilled", "Cycles spilled to disk because the queue was full.",
+                                   stats["spilled"])
+
+
+    def close(self):
+        # Everything queued or spilled is written before this returns
+        self.queue.put(None)
+        self.thread.join()
+        self.write_spilled()
@@ -0,0 +1,128 @@
+"""
+Plant Registry
+
+Loads the plants driven by this bot from bot_config.json: plant id, taxonomy, environment, I2C bus,
+ADS1115 address and channel, calibration file and CSV filename, plus where the soil state, the
+multi-rate streams, the plant metadata table, the shared environment readings and the write-ahead
+log are kept. Paths in the config are relative to the config file.
+"""
+
+import csv
+import json
+import os
+from collections import namedtuple
+
+
+# PLANT_CONFIG points the bot (or a benchmark) at another config file
+CONFIG_FILENAME = os.environ.get("PLANT_CONFIG", os.path.join(os.path.dirname(os.path.abspath(__file__)), "bot_config.json"))
+ADS_CHANNELS = ["P0", "P1", "P2", "P3"]
+# ADDR pin to GND, VDD, SDA or SCL, so up to four ADS1115 per bus
+ADS_ADDRESSES = [0x48, 0x49, 0x4A, 0x4B]
+# Plant metadata table of the normalized layout, one row per plant
+METADATA_HEADERS = ["plant_id", "plant_order", "plant_family", "plant_subfamily", "plant_genus", "environment"]
+
+Plant = namedtuple("Plant", ["plant_id", "plant_order", "plant_family", "plant_subfamily", "plant_genus",
+                             "environment", "channel", "bus", "ads_address", "calibration_file", "csv_filename", "aggregate_filename",
+                             "binary_filename", "readings_filename", "soil_filename", "soil_period"])
+
+
+class PlantRegistry:
+
+
+    def __init__(self, filename=CONFIG_FILENAME):
+        self.filename = filename
+        self.config = self.load_config()
+        self.plants = [self.make_plant(plant) for plant in self.config["plants"]]
+        self.soil_state_file = self.path(self.config.get("soil_state_file", "Calibration-Data/soil_state.json"))
+        self.stream_dir = self.path(self.config.get("stream_dir", "Plant-Data/Streams"))
+        self.metadata_file = self.path(self.config.get("metadata_file", "Plant-Data/plants.csv"))
+        self.environment_file = self.path(self.config.get("environment_file", "Plant-Data/environment.csv"))
+        self.wal_file = self.path(self.config.get("wal_file", "Plant-Data/readings.wal"))
+        self.check_plants()
+
+
+    def __iter__(self):
+        return iter(self.plants)
+
+
+    def __len__(self):
+        return len(self.plants)
+
+
+    def load_config(self):
+        with open(self.filename, 'r') as config_file:
+            return json.load(config_file)
+
+
+    def path(self, filename):
+        return os.path.join(os.path.dirname(os.path.abspath(self.filename)), filename)
+
+
+    def make_plant(self, plant):
+        csv_filename = self.path(plant["csv_filename"])
+        return Plant(
+            plant_id=plant["plant_id"],
+            plant_order=plant["plant_order"],
+            plant_family=plant["plant_family"],
+            plant_subfamily=plant["plant_subfamily"],
+            plant_genus=plant["plant_genus"],
+            environment=plant["environment"],
+            channel=plant["channel"],
+            # I2C bus number and ADS1115 address, "0x49" or 73
+            bus=int(plant.get("bus", 1)),
+            ads_address=int(str(plant.get("ads_address", 0x48)), 0),
+            calibration_file=self.path(plant["calibration_file"]),
+            csv_filename=csv_filename,
+            aggregate_filename=os.path.splitext(csv_filename)[0] + "_aggregate.csv",
+            binary_filename=os.path.splitext(csv_filename)[0] + ".bin",
+            readings_filename=os.path.splitext(csv_filename)[0] + "_readings.csv",
+            soil_filename=os.path.splitext(csv_filename)[0] + "_soil.csv",
+            # seconds between soil reads in multi-rate mode, None for the bot default
+            soil_period=plant.get("soil_period"),
+        )
+
+
+    def check_plants(self):
+        plant_ids = [plant.plant_id for plant in self.plants]
+        if len(set(plant_ids)) != len(plant_ids):
+            raise ValueError(f"Duplicate plant_id in {self.filename}")
+        inputs = set()
+        for plant in self.plants:
+            if plant.channel not in ADS_CHANNELS:
+                raise ValueError(f"Unknown ADS channel {plant.channel} for {plant.plant_id}, expected one of {ADS_CHANNELS}")
+            if plant.ads_address not in ADS_ADDRESSES:
+                raise ValueError(f"Unknown ADS address {plant.ads_address:#x} for {plant.plant_id}, "
+                                 f"expected one of {[hex(address) for address in ADS_ADDRESSES]}")
+            if (plant.bus, plant.ads_address, plant.channel) in inputs:
+                raise ValueError(f"{plant.plant_id} shares bus {plant.bus}, ADS {plant.ads_address:#x}, "
+                                 f"{plant.channel} with another plant")
+            inputs.add((plant.bus, plant.ads_address, plant.channel))
+
+
+    def write_metadata(self):
+        # Rewrite the plant metadata table, atomically so readers never see half of it. Plants no longer
+        # in the config keep their rows, their historical readings still need them
+        os.makedirs(os.path.dirname(self.metadata_file), exist_ok=True)
+        rows = {}
+        try:
+            with open(self.metadata_file, 'r', newline='') as metadata_file:
+                for row in csv.DictReader(metadata_file):
+                    rows[row["plant_id"]] = row
+        except FileNotFoundError:
+            pass
+        for plant in self.plants:
+            rows[plant.plant_id] = plant._asdict()
+        temp_filename = self.metadata_file + ".tmp"
+        with open(temp_filename, 'w', newline='') as metadata_file:
+            writer = csv.DictWriter(metadata_file, fieldnames=METADATA_HEADERS, extrasaction='ignore')
+            writer.writeheader()
+            for row in rows.values():
+                writer.writerow(row)
+        os.replace(temp_filename, self.metadata_file)
+
+
+    def get(self, plant_id):
+        for plant in self.plants:
+            if plant.plant_id == plant_id:
+                return plant
+        raise KeyError(plant_id)
@@ -0,0 +1,100 @@
+"""
+Read Cache
+
+Read-through cache in front of the sensors, so the logging loop, hardware tests and a future
+LCD/keypad UI can all ask for readings without each one hitting the hardware. A value is reused
+for its sensor's TTL (the DHT11 must not be polled faster than about once a second), and callers
+asking while a read is already running wait for that read and share its value or its error
+instead of starting another one. Failed reads are never cached, so retries go to the hardware.
+
+Hits, misses and shared reads are counted per sensor and exported as metrics.
+"""
+
+import threading
+import time
+
+
+class Flight:
+
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.value = None
+        self.error = None
+
+
+class ReadCache:
+
+
+    def __init__(self, ttls=None, default_ttl=0.5, metrics=None):
+        # ttls: sensor name -> seconds a value is reused, default_ttl for the others. 0 only deduplicates
+        self.ttls = dict(ttls or {})
+        self.default_ttl = default_ttl
+        self.metrics = metrics
+        self.lock = threading.Lock()
+        self.values = {}
+        self.flights = {}
+        self.hits = {}
+        self.misses = {}
+        self.shared = {}
+
+
+    def ttl(self, name):
+        return self.ttls.get(name, self.default_ttl)
+
+
+    def count(self, counter, metric, help_text, name):
+        # Called with the lock held
+        counter[name] = counter.get(name, 0) + 1
+        if self.metrics is not None:
+            self.metrics.set_gauge(metric, help_text, counter[name], name)
+
+
+    def get(self, name, read):
+        # Value of the sensor, from the cache, from a read already running, or from read()
+        with self.lock:
+            cached = self.values.get(name)
+            if cached is not None and time.monotonic() - cached[1] < self.ttl(name):
+                self.count(self.hits, "plant_sensor_cache_hits", "Readings served from the cache.", name)
+                return cached[0]
+            flight = self.flights.get(name)
+            leader = flight is None
+            if leader:
+                flight = self.flights[name] = Flight()
+                self.count(self.misses, "plant_sensor_cache_misses", "Readings that went to the hardware.", name)
+            else:
+                self.count(self.shared, "plant_sensor_cache_shared", "Readings that joined a read in flight.", name)
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.value
+
+        try:
+            flight.value = read()
+            with self.lock:
+                self.values[name] = (flight.value, time.monotonic())
+            return flight.value
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self.lock:
+                del self.flights[name]
+            flight.done.set()
+
+
+    def invalidate(self, name=None):
+        with self.lock:
+            if name is None:
+                self.values.clear()
+            else:
+                self.values.pop(name, None)
+
+
+    def stats(self):
+        with self.lock:
+            names = sorted(set(self.hits) | set(self.misses) | set(self.shared))
+            return {name: {"hits": self.hits.get(name, 0), "misses": self.misses.get(name, 0),
+                           "shared": self.shared.get(name, 0)} for name in names}
@@ -0,0 +1,114 @@
+"""
+Retry Scheduler
+
+Runs sensor reads without blocking the cycle on retries. Each read is a single attempt that raises
+RuntimeError when the sensor fails; failed reads are rescheduled with jittered exponential backoff
+while the other reads carry on, and anything still failing at the cycle deadline is given up.
+"""
+
+import heapq
+import math
+import random
+import time
+from collections import namedtuple
+from concurrent.futures import Future, FIRST_COMPLETED, wait
+from utils import printlog
+
+
+# value is None when the read failed, error holds the last exception
+ReadResult = namedtuple("ReadResult", ["value", "attempts", "error"])
+
+
+class RetryScheduler:
+
+
+    def __init__(self, executor=None, max_attempts=3, base_wait=0.5, max_wait=3, jitter=0.5, deadline=9,
+                 metrics=None, routes=None):
+        # Without an executor attempts run inline, still interleaved between reads
+        self.executor = executor
+        # name -> executor of reads that must run on their own, e.g. the worker of the sensor's I2C bus
+        self.routes = routes or {}
+        # Optional SensorMetrics, records the result of every read. Attempts are timed by the reads
+        # themselves, where they reach the hardware
+        self.metrics = metrics
+        self.max_attempts = max_attempts
+        self.base_wait = base_wait
+        self.max_wait = max_wait
+        self.jitter = jitter
+        self.deadline = deadline
+
+
+    def backoff(self, attempt):
+        wait_time = min(self.max_wait, self.base_wait * 2 ** (attempt - 1))
+        return wait_time * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+
+    def submit(self, name, read):
+        executor = self.routes.get(name, self.executor)
+        if executor is not None:
+            return executor.submit(read)
+        future = Future()
+        try:
+            future.set_result(read())
+        except Exception as e:
+            future.set_exception(e)
+        return future
+
+
+    def run(self, reads, deadline=None):
+        # reads: {name: callable}, returns {name: ReadResult}. deadline overrides the cycle deadline, for
+        # every read or per read as {name: seconds}
+        start = time.monotonic()
+        if not isinstance(deadline, dict):
+            deadline = dict.fromkeys(reads, deadline)
+        deadlines = {name: start + (self.deadline if deadline.get(name) is None else deadline[name])
+                     for name in reads}
+        results = {}
+        attempts = dict.fromkeys(reads, 0)
+        due = [(start, name) for name in reads]
+        heapq.heapify(due)
+        running = {}
+
+        while due or running:
+            # Start every read that is due
+            now = time.monotonic()
+            while due and due[0][0] <= now:
+                _, name = heapq.heappop(due)
+                attempts[name] += 1
+                running[self.submit(name, reads[name])] = name
+
+            # Wait for a read to finish, the next retry to fall due or the first deadline of a running read
+            next_due = due[0][0] if due else math.inf
+            next_deadline = min((deadlines[name] for name in running.values()), default=math.inf)
+            timeout = max(0, min(next_due, next_deadline) - time.monotonic())
+            if running:
+                done, _ = wait(running, timeout=timeout, return_when=FIRST_COMPLETED)
+            else:
+                time.sleep(timeout)
+                done = ()
+
+            for future in done:
+                name = running.pop(future)
+                error = future.exception()
+                if error is None:
+                    results[name] = ReadResult(future.result(), attempts[name], None)
+                    continue
+                printlog(f"Error reading {name} (attempt {attempts[name]}): {error}")
+                retry_at = time.monotonic() + self.backoff(attempts[name])
+                if (not isinstance(error, RuntimeError)
+                        or attempts[name] >= self.max_attempts or retry_at > deadlines[name]):
+                    results[name] = ReadResult(None, attempts[name], error)
+                else:
+                    heapq.heappush(due, (retry_at, name))
+
+            # Give up on the reads still hanging on the bus past their deadline
+            now = time.monotonic()
+            for future, name in list(running.items()):
+                if now >= deadlines[name]:
+                    del running[future]
+                    results[name] = ReadResult(None, attempts[name], TimeoutError("cycle deadline reached"))
+
+        if self.metrics is not None:
+            for name, result in results.items():
+                self.metrics.record_result(name, result.attempts, result.value is not None)
+        return results
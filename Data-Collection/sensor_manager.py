@@ -1,73 +1,273 @@
 import time
-import board
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
-import adafruit_dht
-import adafruit_bh1750
 import json
-import busio
 import logging
+import threading
+import functools
+import numpy as np
+from concurrent.futures import ThreadPoolExecutor
+from hardware import get_backend
+from metrics import SensorMetrics
+from read_cache import ReadCache
+from soil_sensor import SoilSensor, soil_percents, soil_watering
+from retry_scheduler import RetryScheduler
+from utils import printlog
 
 
 class SensorManager:
 
 
-    def __init__(self):
-        # Initialize sensors and other properties
-        self.i2c = busio.I2C(board.SCL, board.SDA)
+    def __init__(self, plants, soil_state, backend=None, metrics=None):
+        # Nothing touches the hardware until start()
+        self.backend = backend or get_backend()
+        self.metrics = metrics or SensorMetrics()
+        self.plants = list(plants)
+        self.soil_state = soil_state
+        self.MAX_RETRY = 3
+        self.RETRY_WAIT = 3
+        self.RETRY_BASE_WAIT = 0.5
+        self.CYCLE_DEADLINE = 9
+        self.SAMPLE_DEADLINE = 1.5
+        # Seconds a reading is shared between callers, the DHT11 can't be polled faster than ~1 Hz
+        self.CACHE_TTLS = {"light": 0.5, "air": 2.0}
+        self.SOIL_CACHE_TTL = 0.5
+        # I2C buses in use, the light sensor is always on bus 1
+        self.bus_numbers = sorted({1} | {plant.bus for plant in self.plants})
+        # One worker per bus, so reads queue on their own bus instead of holding workers another bus could use,
+        # and a shared one for the DHT11 and anything else off the I2C buses
+        self.executor = ThreadPoolExecutor(max_workers=2)
+        self.bus_executors = {bus: ThreadPoolExecutor(max_workers=1, thread_name_prefix=f"i2c-{bus}")
+                              for bus in self.bus_numbers}
+        routes = {"light": self.bus_executors[1]}
+        routes.update((plant.plant_id, self.bus_executors[plant.bus]) for plant in self.plants)
+        self.retry_scheduler = RetryScheduler(self.executor, self.MAX_RETRY, self.RETRY_BASE_WAIT,
+                                              self.RETRY_WAIT, deadline=self.CYCLE_DEADLINE, metrics=self.metrics,
+                                              routes=routes)
+        # Oversampling takes a single attempt per sensor, a failed sample is just skipped
+        self.sample_scheduler = RetryScheduler(self.executor, max_attempts=1, deadline=self.SAMPLE_DEADLINE,
+                                               metrics=self.metrics, routes=routes)
+        # Every read goes through the cache, concurrent callers share one hardware read
+        self.cache = ReadCache(self.CACHE_TTLS, self.SOIL_CACHE_TTL, self.metrics)
+        # Only the reads that miss it are timed as attempts
+        self.hardware_reads = {"light": self.metrics.timed("light", self.read_light_sensor),
+                               "air": self.metrics.timed("air", self.read_air_sensor)}
+        # ReadResult (value, attempts, error) of the last read of every sensor
+        self.last_results = {}
+        self.started = False
+
+
+    def start(self, scan=False, data_rate=860, gain=1, scan_period=0.1, dht_process=False, dht_period=2.0,
+              dht_max_age=60):
+        # Initialize sensors and other properties. scan converts every soil channel in the background,
+        # dht_process polls the DHT11 in its own process
+        self.buses = {bus: self.backend.make_i2c(bus) for bus in self.bus_numbers}
+        
+        # Devices on a bus share it, only one transaction at a time. Different buses run in parallel
+        self.bus_locks = {bus: threading.Lock() for bus in self.bus_numbers}
         
-        self.ads = ADS.ADS1115(self.i2c)
-        self.dht = adafruit_dht.DHT11(12)
+        # Up to four ADS1115 per bus
+        self.adcs = {}
+        for plant in self.plants:
+            if (plant.bus, plant.ads_address) not in self.adcs:
+                self.adcs[(plant.bus, plant.ads_address)] = self.backend.make_ads(self.buses[plant.bus], plant.ads_address)
+        self.i2c = self.buses[1]
+        self.i2c_lock = self.bus_locks[1]
+        self.ads = self.adcs.get((1, 0x48))
+        self.dht = None
+        self.dht_reader = None
+        if dht_process:
+            from dht_reader import DHTReader
+            self.dht_reader = DHTReader(self.backend.config, 12, dht_period, dht_max_age, self.metrics).start()
+            self.dht_reader.wait_ready(3 * dht_period)
+        else:
+            self.dht = self.backend.make_dht(12)
         # print(f"(Sensors) Initialized i2c for sensors = {self.i2c}")
+        # One soil sensor per registered plant, in registry order
         self.soil_sensors = [
-            SoilMoistureSensor(self.i2c, self.ads, "peace-lily-1", 'calibration_data_1.json'),
-            SoilMoistureSensor(self.i2c, self.ads, "peace-lily-2", 'calibration_data_2.json')
+            SoilSensor(self.buses[plant.bus], self.adcs[(plant.bus, plant.ads_address)], plant.plant_id,
+                       plant.calibration_file, plant.channel, self.bus_locks[plant.bus], self.soil_state,
+                       self.backend, self.metrics)
+            for plant in self.plants
         ]
-        self.light_sensor = adafruit_bh1750.BH1750(self.i2c, address=0x23)
-        self.MAX_RETRY = 3
-        self.RETRY_WAIT = 3
+        # Calibration and last levels of every plant as arrays, converted in one pass
+        self.dry_voltages = np.array([sensor.calibration_data["max_value"] for sensor in self.soil_sensors], dtype=float)
+        self.wet_voltages = np.array([sensor.calibration_data["min_value"] for sensor in self.soil_sensors], dtype=float)
+        self.last_levels = np.array([sensor.last_soil_moisture_reading for sensor in self.soil_sensors], dtype=float)
+        self.light_sensor = self.backend.make_light_sensor(self.i2c, address=0x23)
+        # Cached single attempt read of every soil channel, by plant_id
+        self.soil_reads = {sensor.plant_id: functools.partial(self.cache.get, sensor.plant_id,
+                                                              self.metrics.timed(sensor.plant_id, sensor.read_voltage))
+                           for sensor in self.soil_sensors}
+        # One scanner per bus, cycling through the channels of every ADS1115 on it
+        self.scanners = []
+        if scan:
+            from ads_scanner import ADSScanner
+            for bus in self.bus_numbers:
+                sensors = [sensor for sensor, plant in zip(self.soil_sensors, self.plants) if plant.bus == bus]
+                if not sensors:
+                    continue
+                adcs = [ads for (ads_bus, _), ads in self.adcs.items() if ads_bus == bus]
+                channels = {sensor.plant_id: sensor.soil_moisture_chan for sensor in sensors}
+                scanner = ADSScanner(adcs, channels, self.bus_locks[bus], data_rate, gain, scan_period,
+                                     mode=self.backend.ads_continuous_mode(), metrics=self.metrics).start()
+                self.scanners.append(scanner)
+                for sensor in sensors:
+                    sensor.scanner = scanner
+        self.started = True
+        return self
 
 
-    def get_soil_readings(self):
-        soil_data = []
+    def stop(self):
+        if self.started:
+            for scanner in self.scanners:
+                scanner.stop()
+        self.executor.shutdown()
+        for executor in self.bus_executors.values():
+            executor.shutdown()
+        self.metrics.close()
+        if self.started and self.dht_reader is not None:
+            self.dht_reader.stop()
+        if self.started and hasattr(self.dht, "exit"):
+            # Release the DHT GPIO
+            self.dht.exit()
+        self.started = False
 
+
+    def get_soil_readings(self):
         printlog("\nReading Soils...")
+        voltages = []
         for sensor in self.soil_sensors:
-            data = sensor.get_soil_reading()
-            if data:
-                soil_data.append(data)
+            result = sensor.retry_scheduler.run({sensor.plant_id: self.soil_reads[sensor.plant_id]})[sensor.plant_id]
+            sensor.attempts = result.attempts
+            voltages.append(result.value)
         
+        return self.soil_results(voltages)
+
+
+    def soil_percents(self, voltages, indices=None):
+        # voltages in soil_sensors order, None where the read failed. indices selects a subset of plants
+        indices = slice(None) if indices is None else np.asarray(indices)
+        return soil_percents(np.array(voltages, dtype=float), self.dry_voltages[indices], self.wet_voltages[indices])
+
+
+    def soil_readings(self, soil_moisture_percents, indices=None):
+        # Watering check and last level update for every plant (or the indices subset) at once
+        indices = np.arange(len(self.plants)) if indices is None else np.asarray(indices)
+        was_watered, ml = soil_watering(soil_moisture_percents, self.last_levels[indices])
+        valid = ~np.isnan(soil_moisture_percents)
+        self.last_levels[indices[valid]] = soil_moisture_percents[valid].round(2)
+        # Persisted with one journal write for the whole cycle
+        self.soil_state.update_many((self.plants[index].plant_id, float(self.last_levels[index]))
+                                    for index in indices[valid])
+
+        soil_data = []
+        plants = [self.plants[index] for index in indices]
+        for plant, percent, watered, water_ml, ok in zip(plants, soil_moisture_percents.round(2).tolist(),
+                                                        was_watered.tolist(), ml.tolist(), valid.tolist()):
+            if ok:
+                soil_data.append((percent, watered, water_ml))
+            else:
+                printlog(f"!!! Impossible to retreive Soil Moisture for {plant.plant_id} !!!")
+                soil_data.append((None, None, None))
+        printlog(f"Soils OK! {soil_data}")
         return soil_data
 
+
+    def soil_results(self, voltages, indices=None):
+        return self.soil_readings(self.soil_percents(voltages, indices), indices)
+
+
+    def read_batch(self, reads, deadline=None):
+        # Run a batch of single attempt reads together, e.g. coalesced multi-rate streams. deadline can be
+        # {name: seconds} per read
+        results = self.retry_scheduler.run(reads, deadline)
+        self.last_results.update(results)
+        return results
+
+
+    def get_all_readings(self):
+        # Read light, air and every soil channel at the same time, retrying without blocking the others
+        printlog("\nReading all sensors...")
+        reads = {"light": self.read_light, "air": self.read_air}
+        for sensor in self.soil_sensors:
+            reads[sensor.plant_id] = self.soil_reads[sensor.plant_id]
+        results = self.retry_scheduler.run(reads)
+        self.last_results.update(results)
+
+        lux = self.light_result(results["light"])
+        air = self.air_result(results["air"])
+        voltages = []
+        for sensor in self.soil_sensors:
+            result = results[sensor.plant_id]
+            sensor.attempts = result.attempts
+            voltages.append(result.value)
+
+        return lux, air, self.soil_results(voltages)
+
+
+    def sample_once(self):
+        # One concurrent pass over every sensor without retries, failed reads come back as None
+        reads = {"light": self.read_light, "air": self.read_air}
+        for sensor in self.soil_sensors:
+            reads[sensor.plant_id] = self.soil_reads[sensor.plant_id]
+        results = self.sample_scheduler.run(reads)
+        return {name: result.value for name, result in results.items()}
+
+
+    def read_light(self):
+        # Single attempt, raises RuntimeError on failure
+        return self.cache.get("light", self.hardware_reads["light"])
+
+
+    def read_air(self):
+        # Single attempt, raises RuntimeError on failure
+        return self.cache.get("air", self.hardware_reads["air"])
+
+
+    def read_light_sensor(self):
+        with self.i2c_lock:
+            return round(self.light_sensor.lux, 2)
+
+
+    def read_air_sensor(self):
+        if self.dht_reader is not None:
+            # Last value published by the DHT process, never waits on the sensor
+            return self.dht_reader.read()
+        humidity = self.dht.humidity
+        temperature = self.dht.temperature
+        return humidity, temperature
+
+
+    def light_result(self, result):
+        if result.value is None:
+            printlog(f"!!! Impossible to retreive Light ({result.attempts} attempts) !!!")
+        else:
+            printlog(f"Light OK! {result.value} ({result.attempts} attempts)")
+        return result.value
+
+
+    def air_result(self, result):
+        if result.value is None:
+            # The cycle still logs soil and light, with blank air fields
+            printlog(f"!!! Impossible to retreive Air ({result.attempts} attempts) !!!")
+            return None, None
+        humidity, temperature = result.value
+        printlog(f"Air OK! {humidity}%, {temperature}C ({result.attempts} attempts)")
+        return result.value
+
     
     def get_light_reading(self):
 
         printlog("\nReading Light...")
-        for _ in range(self.MAX_RETRY):
-            try:
-                # read and return light value
-                lux = self.light_sensor.lux
-                printlog(f"Light OK! {round(lux, 2)}")
-                return round(lux, 2)
-            except RuntimeError as e:
-                printlog(f"Error reading Light sensor: {e}")
-                time.sleep(self.RETRY_WAIT)  
-        return None  
+        result = self.retry_scheduler.run({"light": self.read_light})["light"]
+        self.last_results["light"] = result
+        return self.light_result(result)
 
 
     def get_air_reading(self):
         printlog("\nReading Air...")
-        for _ in range(self.MAX_RETRY):
-                try:
-                    # read and return air values
-                    humidity = self.dht.humidity
-                    temperature = self.dht.temperature
-                    printlog(f"Air OK! {humidity}%, {temperature}C")
-                    return humidity, temperature
-                except RuntimeError as e:
-                    printlog(f"Error reading DHT sensor: {e}")
-                    time.sleep(self.RETRY_WAIT) 
-        return None  
+        result = self.retry_scheduler.run({"air": self.read_air})["air"]
+        self.last_results["air"] = result
+        return self.air_result(result)
 
 
     def test(self):
@@ -77,4 +277,4 @@ class SensorManager:
         light = self.get_light_reading()
         print(f"Light = {light}\nGetting Soils")
         soils = self.get_soil_readings()
-        print(f"Soils = {soils}")
+        print(f"Soils = {soils}\nCache = {self.cache.stats()}")
@@ -1,32 +1,58 @@
 import time
-import board
-import adafruit_ads1x15.ads1115 as ADS
-from adafruit_ads1x15.analog_in import AnalogIn
-import adafruit_dht
-import adafruit_bh1750
 import json
-import busio
 import logging
+import threading
+import numpy as np
+from hardware import get_backend
+from retry_scheduler import RetryScheduler
+from utils import printlog
+
+
+def soil_percents(voltages, dry_voltages, wet_voltages):
+    # Vectorized SoilSensor.voltage_to_percent over every plant, failed reads (NaN) stay NaN
+    with np.errstate(invalid='ignore', divide='ignore'):
+        return np.clip((voltages - dry_voltages) / (wet_voltages - dry_voltages) * 100, 0, 100)
+
+
+def soil_watering(soil_moisture_percents, last_levels):
+    # Vectorized SoilSensor.update_watering, returns was_watered and ml for every plant
+    with np.errstate(invalid='ignore'):
+        was_watered = (soil_moisture_percents > last_levels + 5).astype(np.int8)
+    return was_watered, was_watered.astype(np.int16) * 1000
 
 
 class SoilSensor:
     
 
-    def __init__(self, i2c, ads, plant_id, filename):
+    def __init__(self, i2c, ads, plant_id, filename, channel, i2c_lock=None, soil_state=None, backend=None,
+                 metrics=None, scanner=None):
         self.i2c = i2c
         self.ads = ads
+        self.i2c_lock = i2c_lock or threading.Lock()
         self.filename = filename
 
-        if plant_id == "peace-lily-1": 
-            self.soil_moisture_chan = AnalogIn(self.ads, ADS.P0) 
-        elif plant_id == "peace-lily-2":
-            self.soil_moisture_chan = AnalogIn(self.ads, ADS.P1)
+        # channel is the ADS pin name, "P0" to "P3"
+        self.channel = channel
+        self.soil_moisture_chan = (backend or get_backend()).make_analog_in(self.ads, channel)
+        # ADSScanner converting this channel in the background, None for single-shot reads
+        self.scanner = scanner
 
         self.plant_id = plant_id
-        self.last_soil_moisture_reading = 0.0
         self.calibration_data = self.load_calibration_data()
+        # last_level lives in the soil state store, older calibration files still carry one
+        self.soil_state = soil_state
+        self.last_soil_moisture_reading = self.calibration_data.get("last_level", 0.0)
+        if self.soil_state is not None:
+            self.last_soil_moisture_reading = self.soil_state.get(plant_id, self.last_soil_moisture_reading)
         self.MAX_RETRY = 3
         self.RETRY_WAIT = 3
+        self.RETRY_BASE_WAIT = 0.5
+        self.retry_scheduler = RetryScheduler(max_attempts=self.MAX_RETRY, base_wait=self.RETRY_BASE_WAIT,
+                                              max_wait=self.RETRY_WAIT, metrics=metrics)
+        # Every attempt reaches the hardware, there is no cache in front of it here
+        self.timed_read_voltage = metrics.timed(plant_id, self.read_voltage) if metrics is not None else self.read_voltage
+        # attempts taken by the last reading
+        self.attempts = 0
      
 
     def load_calibration_data(self):
@@ -45,43 +71,60 @@ class SoilSensor:
 
 
     def update_last_level(self, new_level):
-        self.calibration_data["last_level"] = new_level
-        self.save_calibration_data()
+        self.last_soil_moisture_reading = new_level
+        if self.soil_state is not None:
+            self.soil_state.update(self.plant_id, new_level)
 
 
-    def get_soil_reading(self):
+    def read_voltage(self):
+        # Single attempt, raises RuntimeError on failure. Hold the bus only for the conversion
+        if self.scanner is not None:
+            return self.scanner.latest(self.plant_id)
+        with self.i2c_lock:
+            return self.soil_moisture_chan.voltage
+
+
+    def voltage_to_percent(self, voltage):
+        # Set calibrated data
+        min_soil_moisture = self.calibration_data["max_value"]
+        max_soil_moisture = self.calibration_data["min_value"]
+        # calculate percentage
+        soil_moisture_percent = (
+            (voltage - min_soil_moisture) / (
+                max_soil_moisture - min_soil_moisture
+            )
+        ) * 100
+
+        # correct for occasional over or under scale
+        if soil_moisture_percent >= 100:
+            soil_moisture_percent = 100.0
+        elif soil_moisture_percent <= 0:
+            soil_moisture_percent = 0
+        return soil_moisture_percent
+
 
-        for _ in range(self.MAX_RETRY):
-            try:
-                # Set calibrated data
-                min_soil_moisture = self.calibration_data["max_value"]
-                max_soil_moisture = self.calibration_data["min_value"]
-                self.last_soil_moisture_reading = self.calibration_data["last_level"]
-                # calculate percentage
-                soil_moisture_percent = (
-                    (self.soil_moisture_chan.voltage - min_soil_moisture) / (
-                        max_soil_moisture - min_soil_moisture
-                    )
-                ) * 100
-
-                # correct for occasional over or under scale
-                if soil_moisture_percent >= 100:
-                    soil_moisture_percent = 100.0
-                elif soil_moisture_percent <= 0:
-                    soil_moisture_percent = 0
-
-                # Return new soil moisture, was_watered, and ml
-                was_watered = 1 if soil_moisture_percent > self.last_soil_moisture_reading + 5 else 0
-                ml = 1000 if was_watered == 1 else 0
-
-                self.update_last_level(round(soil_moisture_percent, 2))
-
-                printlog(f"\n{self.plant_id}:\nSoil: {round(soil_moisture_percent, 2)}\nWatered: {was_watered}, {ml}")
-                return round(soil_moisture_percent, 2), was_watered, ml
-            
-            except RuntimeError as e:
-                printlog(f"Error reading Soil sensor: {e}")
-                print("Retrying...")
-                time.sleep(self.RETRY_WAIT)
-        printlog(f"!!! Impossible to retreive Soil Moisture !!!")
-        return None, None, None
\ No newline at end of file
+    def update_watering(self, soil_moisture_percent):
+        # Return new soil moisture, was_watered, and ml
+        was_watered = 1 if soil_moisture_percent > self.last_soil_moisture_reading + 5 else 0
+        ml = 1000 if was_watered == 1 else 0
+
+        self.update_last_level(round(soil_moisture_percent, 2))
+        return was_watered, ml
+
+
+    def soil_result(self, result):
+        if result.value is None:
+            printlog(f"!!! Impossible to retreive Soil Moisture ({result.attempts} attempts) !!!")
+            return None, None, None
+
+        soil_moisture_percent = self.voltage_to_percent(result.value)
+        was_watered, ml = self.update_watering(soil_moisture_percent)
+
+        printlog(f"\n{self.plant_id}:\nSoil: {round(soil_moisture_percent, 2)}\nWatered: {was_watered}, {ml} ({result.attempts} attempts)")
+        return round(soil_moisture_percent, 2), was_watered, ml
+
+
+    def get_soil_reading(self):
+        result = self.retry_scheduler.run({self.plant_id: self.timed_read_voltage})[self.plant_id]
+        self.attempts = result.attempts
+        return self.soil_result(result)
\ No newline at end of file
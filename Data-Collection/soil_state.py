@@ -0,0 +1,97 @@
+"""
+Soil State
+
+Keeps the last soil moisture level of every plant in memory, separate from the calibration files.
+Every update is appended to a small journal, and every `checkpoint_every` entries the whole state is
+written to a temp file and renamed over the checkpoint, so a power cut can never leave it truncated.
+On startup the state is recovered from the checkpoint plus the journal entries written after it.
+"""
+
+import json
+import os
+from utils import printlog
+
+
+class SoilStateStore:
+
+
+    def __init__(self, filename, checkpoint_every=48, fsync=False):
+        self.filename = filename
+        self.journal_filename = filename + ".journal"
+        self.checkpoint_every = checkpoint_every
+        self.fsync = fsync
+        self.last_levels = {}
+        self.updates = 0
+        self.recover()
+        self.journal = open(self.journal_filename, 'a')
+
+
+    def recover(self):
+        try:
+            with open(self.filename, 'r') as state_file:
+                self.last_levels = json.load(state_file)["last_level"]
+        except FileNotFoundError:
+            pass
+        except (ValueError, KeyError) as e:
+            printlog(f"Error reading soil state checkpoint {self.filename}: {e}")
+
+        try:
+            with open(self.journal_filename, 'rb') as journal:
+                data = journal.read()
+        except FileNotFoundError:
+            return
+        # A torn last line from a power cut has no newline, it is cut off so the next entries start clean
+        end = data.rfind(b"\n") + 1
+        if end < len(data):
+            printlog(f"Soil state journal {self.journal_filename}: dropping a torn last line of {len(data) - end} bytes")
+            with open(self.journal_filename, 'r+b') as journal:
+                journal.truncate(end)
+        for number, line in enumerate(data[:end].splitlines(), 1):
+            try:
+                plant_id, last_level = line.decode().split()
+                self.last_levels[plant_id] = float(last_level)
+                self.updates += 1
+            except ValueError:
+                printlog(f"Skipping line {number} of the soil state journal {self.journal_filename}: {line!r}")
+
+
+    def get(self, plant_id, default=0):
+        return self.last_levels.get(plant_id, default)
+
+
+    def update(self, plant_id, last_level):
+        self.update_many([(plant_id, last_level)])
+
+
+    def update_many(self, last_levels):
+        # One journal write for every plant of a cycle
+        entries = []
+        for plant_id, last_level in last_levels:
+            self.last_levels[plant_id] = last_level
+            entries.append(f"{plant_id} {last_level}\n")
+        if not entries:
+            return
+        self.journal.write("".join(entries))
+        self.journal.flush()
+        if self.fsync:
+            os.fsync(self.journal.fileno())
+        self.updates += len(entries)
+        if self.updates >= self.checkpoint_every:
+            self.checkpoint()
+
+
+    def checkpoint(self):
+        temp_filename = self.filename + ".tmp"
+        with open(temp_filename, 'w') as state_file:
+            json.dump({"last_level": self.last_levels}, state_file)
+            state_file.flush()
+            os.fsync(state_file.fileno())
+        os.replace(temp_filename, self.filename)
+        # Everything in the journal is now in the checkpoint
+        self.journal.truncate(0)
+        self.updates = 0
+
+
+    def close(self):
+        self.checkpoint()
+        self.journal.close()
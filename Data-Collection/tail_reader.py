@@ -0,0 +1,89 @@
+"""
+Tail Reader
+
+Finds the last complete reading of a plant file by reading backward from its end in small blocks,
+so the cost doesn't depend on how long the history is. A final line (or binary record) torn by a
+power cut is cut off, leaving the file ending on a complete row for the next append.
+
+On startup data_collection uses it to restore the last soil level and the time of the last reading
+and to report how long collection was stopped.
+"""
+
+import csv
+import math
+import os
+from collections import namedtuple
+from utils import printlog, row_timestamp
+
+
+BLOCK_SIZE = 4096
+
+# row: the last complete reading as a dict (None for an empty file), repaired: bytes cut off the end
+Tail = namedtuple("Tail", ["row", "timestamp", "repaired"])
+
+
+def read_csv_tail(filename, repair=True):
+    with open(filename, 'rb+' if repair else 'rb') as file:
+        header = file.readline()
+        if not header.endswith(b"\n"):
+            # Torn before the header was even complete, start the file over
+            if repair:
+                printlog(f"Repairing {filename}: dropping a torn header of {len(header)} bytes")
+                file.truncate(0)
+            return Tail(None, None, len(header))
+        headers = next(csv.reader([header.decode()]), None)
+        data_start = file.tell()
+        size = file.seek(0, os.SEEK_END)
+        # Read backward until the blocks hold the newline ending the last complete line and the one before it
+        tail = b""
+        position = size
+        end = 0
+        while position > data_start and (end == 0 or tail.rfind(b"\n", 0, end - 1) < 0):
+            step = min(BLOCK_SIZE, position - data_start)
+            position -= step
+            file.seek(position)
+            tail = file.read(step) + tail
+            end = tail.rfind(b"\n") + 1
+        repaired = len(tail) - end
+        if repaired and repair:
+            printlog(f"Repairing {filename}: dropping a torn last line of {repaired} bytes")
+            file.truncate(position + end)
+        lines = tail[:end].splitlines()
+    if headers is None or not lines or position + end <= data_start:
+        return Tail(None, None, repaired)
+    row = next(csv.reader([lines[-1].decode()]))
+    if len(row) != len(headers):
+        return Tail(None, None, repaired)
+    row = dict(zip(headers, row))
+    return Tail(row, row_timestamp(row), repaired)
+
+
+def read_binary_tail(filename, repair=True):
+    from binary_log import HEADER, RECORD, FLOAT_FIELDS, MISSING_FLAGS, MISSING_WATERING, load_plant_ids
+
+    with open(filename, 'rb+' if repair else 'rb') as file:
+        size = file.seek(0, os.SEEK_END)
+        # Records are fixed width, the last complete one is found by arithmetic
+        repaired = max(size - HEADER.size, 0) % RECORD.size
+        if repaired and repair:
+            printlog(f"Repairing {filename}: dropping a torn last record of {repaired} bytes")
+            file.truncate(size - repaired)
+        if size - repaired - HEADER.size < RECORD.size:
+            return Tail(None, None, repaired)
+        file.seek(size - repaired - RECORD.size)
+        timestamp, *values, ml, was_watered, flags, plant = RECORD.unpack(file.read(RECORD.size))
+    row = {"plant_id": load_plant_ids(filename)[plant]}
+    for field, value, flag in zip(FLOAT_FIELDS, values, MISSING_FLAGS):
+        row[field] = None if flags & flag or math.isnan(value) else value
+    if not flags & MISSING_WATERING:
+        row.update(was_watered=was_watered, ml=ml)
+    return Tail(row, timestamp, repaired)
+
+
+def read_tail(filename, repair=True):
+    # Compressed partitions are closed and were complete when they were compressed
+    if not os.path.exists(filename) or os.path.getsize(filename) == 0 or filename.endswith((".xz", ".gz")):
+        return Tail(None, None, 0)
+    if filename.endswith(".bin"):
+        return read_binary_tail(filename, repair)
+    return read_csv_tail(filename, repair)
@@ -0,0 +1,5 @@
+import os
+import sys
+
+# The collector is a flat set of scripts, tests import them the way they import each other
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,38 @@
+"""
+Binary log: records read back as columns, and a record torn by a power cut is dropped before
+appending, so later records stay aligned.
+"""
+
+import os
+import pytest
+from binary_log import BinaryLogReader, BinaryLogWriter, HEADER, MISSING_LUX, RECORD
+
+
+def binary_reading(time):
+    return {"day": "2024-03-01", "time": time, "soil_moisture_percent": 50.0, "lux": 100.0, "temperature": 21,
+            "humidity": 55, "was_watered": 0, "ml": 0, "plant_id": "plant-1"}
+
+
+def test_partial_binary_record_is_dropped_before_appending(tmp_path):
+    filename = str(tmp_path / "plant_data.bin")
+    with BinaryLogWriter() as writer:
+        writer.write(filename, binary_reading("00:00:00"))
+    with open(filename, 'ab') as file:
+        file.write(b"torn")
+    with BinaryLogWriter() as writer:
+        writer.write(filename, binary_reading("00:30:00"))
+    assert os.path.getsize(filename) == HEADER.size + 2 * RECORD.size
+
+
+def test_records_read_back_as_columns(tmp_path):
+    pytest.importorskip("numpy")
+    filename = str(tmp_path / "plant_data.bin")
+    with BinaryLogWriter() as writer:
+        writer.write(filename, binary_reading("00:00:00"))
+        writer.write(filename, dict(binary_reading("00:30:00"), lux=None))
+    reader = BinaryLogReader(filename)
+    assert len(reader) == 2
+    assert reader["soil_moisture_percent"].tolist() == [50.0, 50.0]
+    assert reader["timestamp"][1] - reader["timestamp"][0] == 1800
+    assert reader.missing(MISSING_LUX).tolist() == [False, True]
+    assert reader.plant_id(reader["plant"][0]) == "plant-1"
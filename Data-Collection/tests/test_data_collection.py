@@ -0,0 +1,26 @@
+"""
+Collection cycle: a DHT11 that never answers leaves the air fields blank, the rest of the cycle is
+still read and logged.
+"""
+
+import pytest
+
+
+def test_failed_air_read_keeps_the_cycle(tmp_path, monkeypatch):
+    pytest.importorskip("numpy")
+    import benchmark
+    import data_collection
+
+    monkeypatch.setenv("PLANT_BACKEND", "sim")
+    config = benchmark.write_config(str(tmp_path), 2, {"sensors": {"dht": {"failure_rate": 1.0}}})
+    monkeypatch.setattr(data_collection, "WAL", False)
+    data_collection.start(config)
+    try:
+        data_collection.sensor_manager.RETRY_WAIT = 0
+        rows = data_collection.package_data()
+    finally:
+        data_collection.stop()
+    assert rows is not None
+    for row in rows.values():
+        assert row["humidity"] is None and row["temperature"] is None
+        assert row["soil_moisture_percent"] is not None
@@ -0,0 +1,82 @@
+"""
+DataWriter: headers, the row and time flush policy checked once per cycle, the tail on close and
+the sparse index.
+"""
+
+from data_writer import DataWriter, INDEX_ENTRY
+
+
+HEADERS = ["day", "time", "soil_moisture_percent", "plant_id"]
+
+
+def reading(time, plant_id="plant-1"):
+    return {"day": "2024-03-01", "time": time, "soil_moisture_percent": 50.0, "plant_id": plant_id}
+
+
+def lines(filename):
+    with open(filename) as file:
+        return file.read().splitlines()
+
+
+def test_header_only_on_a_new_file(tmp_path):
+    filename = str(tmp_path / "plant_data_1.csv")
+    with DataWriter(HEADERS) as writer:
+        writer.write(filename, reading("00:00:00"))
+    with DataWriter(HEADERS) as writer:
+        writer.write(filename, reading("00:30:00"))
+    assert lines(filename) == ["day,time,soil_moisture_percent,plant_id", "2024-03-01,00:00:00,50.0,plant-1",
+                               "2024-03-01,00:30:00,50.0,plant-1"]
+
+
+def test_whole_cycle_is_flushed_once_enough_rows_are_buffered(tmp_path):
+    filenames = [str(tmp_path / f"plant_data_{number}.csv") for number in range(1, 4)]
+    writer = DataWriter(HEADERS, flush_rows=4, flush_seconds=600)
+    for time in ["00:00:00", "00:30:00"]:
+        for number, filename in enumerate(filenames, 1):
+            writer.write(filename, reading(time, f"plant-{number}"))
+        writer.flush_if_due()
+    # 6 rows past the 4 row threshold, every plant's rows of both cycles written together
+    assert writer.pending_rows == 0
+    assert [len(lines(filename)) for filename in filenames] == [3, 3, 3]
+    writer.close()
+
+
+def test_rows_wait_for_the_row_or_time_threshold(tmp_path):
+    filename = str(tmp_path / "plant_data_1.csv")
+    writer = DataWriter(HEADERS, flush_rows=20, flush_seconds=600)
+    writer.write(filename, reading("00:00:00"))
+    assert not writer.flush_if_due()
+    assert lines(filename) == []
+
+    writer.last_flush -= 600
+    assert writer.flush_if_due()
+    assert lines(filename)[1:] == ["2024-03-01,00:00:00,50.0,plant-1"]
+    writer.close()
+
+
+def test_close_writes_the_buffered_tail(tmp_path):
+    filename = str(tmp_path / "plant_data_1.csv")
+    writer = DataWriter(HEADERS, flush_rows=20, flush_seconds=600)
+    writer.write(filename, reading("00:00:00"))
+    writer.write(filename, reading("00:30:00"))
+    writer.close()
+    assert lines(filename)[1:] == ["2024-03-01,00:00:00,50.0,plant-1", "2024-03-01,00:30:00,50.0,plant-1"]
+    assert writer.pending_rows == 0
+
+
+def test_index_entry_every_few_rows_whatever_the_flush_size(tmp_path):
+    filename = str(tmp_path / "plant_data_1.csv")
+    writer = DataWriter(HEADERS, flush_rows=1, index=True, index_rows=4)
+    for minute in range(10):
+        writer.write(filename, reading(f"00:{minute:02d}:00"))
+        writer.flush_if_due()
+    writer.close()
+    with open(filename + ".idx", 'rb') as index_file:
+        entries = list(INDEX_ENTRY.iter_unpack(index_file.read()))
+    assert len(entries) == 3
+    times = []
+    with open(filename, 'rb') as file:
+        for _, offset in entries:
+            file.seek(offset)
+            times.append(file.readline().split(b",")[1])
+    assert times == [b"00:00:00", b"00:04:00", b"00:08:00"]
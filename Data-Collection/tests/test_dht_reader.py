@@ -0,0 +1,31 @@
+"""
+DHT reader process: reads take the last valid value it published and fail at once when there is none.
+"""
+
+import pytest
+from dht_reader import DHTReader
+
+
+def reader(failure_rate):
+    return DHTReader({"backend": "sim", "sim": {"sensors": {"dht": {"failure_rate": failure_rate}}}}, period=0.1)
+
+
+def test_reads_take_the_last_published_value():
+    dht = reader(0.0).start()
+    try:
+        assert dht.wait_ready(5)
+        humidity, temperature = dht.read()
+        assert isinstance(humidity, int) and isinstance(temperature, int)
+        assert dht.latest().quality == "good"
+    finally:
+        dht.stop()
+
+
+def test_read_fails_at_once_without_a_valid_value():
+    dht = reader(1.0).start()
+    try:
+        assert not dht.wait_ready(0.5)
+        with pytest.raises(TimeoutError):
+            dht.read()
+    finally:
+        dht.stop()
@@ -0,0 +1,33 @@
+"""
+Live feed: readers never see a snapshot torn by a publish in progress.
+"""
+
+import threading
+import pytest
+
+
+def test_live_feed_snapshots_are_never_torn():
+    live_feed = pytest.importorskip("live_feed")
+    key = 0x7E570000 + threading.get_ident() % 0xFFFF
+    writer = live_feed.LiveFeedWriter(["a", "b"], key)
+    reader = live_feed.LiveFeedReader(key)
+    stopped = threading.Event()
+
+    def publish():
+        value = 0
+        while not stopped.is_set():
+            value += 1
+            writer.publish({"lux": value}, {"a": {"ml": value}, "b": {"ml": value}})
+
+    thread = threading.Thread(target=publish)
+    thread.start()
+    try:
+        for _ in range(2000):
+            snapshot = reader.snapshot()
+            values = {snapshot.environment["lux"]} | {plant["ml"] for plant in snapshot.plants.values()}
+            assert len(values) == 1
+    finally:
+        stopped.set()
+        thread.join()
+        reader.close()
+        writer.close(remove=True)
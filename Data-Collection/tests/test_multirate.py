@@ -0,0 +1,29 @@
+"""
+Multi-rate sampling: the DHT11 is never batched with the I2C streams, every read retries until its
+own deadline and rows carry the tick they were due for.
+"""
+
+import time
+from multirate import MultiRateScheduler, Stream
+from retry_scheduler import RetryScheduler
+
+
+def failing_read():
+    raise RuntimeError("sensor failure")
+
+
+def test_each_read_retries_until_its_own_deadline():
+    scheduler = RetryScheduler(max_attempts=10, base_wait=0.1, max_wait=0.1, jitter=0)
+    results = scheduler.run({"light": failing_read, "air": failing_read}, {"light": 0.15, "air": 0.45})
+    assert results["light"].attempts == 2
+    assert results["air"].attempts == 5
+
+
+def test_dht_is_batched_apart_and_streams_keep_their_tick():
+    streams = [Stream("light", 1, {"light": None}, [], "light.csv"),
+               Stream("air", 1, {"air": None}, [], "air.csv", group="dht")]
+    batches = MultiRateScheduler(streams).wait()
+    assert sorted([stream.name for stream in batch] for batch in batches) == [["air"], ["light"]]
+    # Due on the same whole second, at most a moment ago
+    assert streams[0].tick == streams[1].tick == int(streams[0].tick)
+    assert 0 <= time.time() - streams[0].tick < 0.5
@@ -0,0 +1,24 @@
+"""
+Oversampler: the median buffer decimates instead of growing, whatever its capacity.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+from oversampler import IntervalBuffer
+
+
+@pytest.mark.parametrize("capacity", [2, 5, 1024])
+def test_buffer_decimates_at_any_capacity(capacity):
+    buffer = IntervalBuffer(capacity)
+    for value in range(1000):
+        buffer.add(float(value))
+    aggregate = buffer.aggregate()
+    assert buffer.size <= capacity
+    assert aggregate["count"] == 1000 and aggregate["mean"] == 499.5
+    assert 0 <= aggregate["median"] <= 999
+
+
+def test_buffer_rejects_a_capacity_below_two():
+    with pytest.raises(ValueError):
+        IntervalBuffer(1)
@@ -0,0 +1,49 @@
+"""
+Partitions: an open partition a crash kept out of the manifest is still found and repaired, and the
+manifest follows the rows on disk.
+"""
+
+import json
+from data_writer import DataWriter
+from partitions import MANIFEST_FILENAME, PartitionedWriter, find_partitions
+from tail_reader import read_tail
+
+
+HEADERS = ["day", "time", "soil_moisture_percent", "plant_id"]
+
+
+def reading(day, time, percent=50.0, plant_id="plant-1"):
+    return {"day": day, "time": time, "soil_moisture_percent": percent, "plant_id": plant_id}
+
+
+def test_open_partition_is_found_and_repaired_without_a_rotation(tmp_path):
+    filename = str(tmp_path / "plant_data_1.csv")
+    writer = PartitionedWriter(DataWriter(HEADERS, flush_rows=1), "day", None)
+    writer.write(filename, reading("2024-03-01", "00:00:00"))
+    writer.flush_if_due()
+    # Power cut: a torn row, and neither rotate() nor close() ever ran
+    partition = str(tmp_path / "plant-1" / "2024-03-01.csv")
+    with open(partition, 'a') as file:
+        file.write("2024-03-01,00:30:00,5")
+
+    assert find_partitions(str(tmp_path / "plant-1")) == [partition]
+    tail = read_tail(partition)
+    assert tail.repaired and tail.row["time"] == "00:00:00"
+
+    writer = PartitionedWriter(DataWriter(HEADERS, flush_rows=1), "day", None)
+    writer.write(filename, reading("2024-03-01", "01:00:00"))
+    writer.flush_if_due()
+    with open(partition) as file:
+        assert file.read().splitlines()[1:] == ["2024-03-01,00:00:00,50.0,plant-1", "2024-03-01,01:00:00,50.0,plant-1"]
+
+
+def test_manifest_follows_every_flush(tmp_path):
+    filename = str(tmp_path / "plant_data_1.csv")
+    writer = PartitionedWriter(DataWriter(HEADERS, flush_rows=1), "day", None)
+    for time in ["2024-03-01 00:00:00", "2024-03-02 00:00:00", "2024-03-02 00:30:00"]:
+        # One row per cycle
+        writer.write(filename, reading(*time.split()))
+        writer.flush_if_due()
+    with open(tmp_path / "plant-1" / MANIFEST_FILENAME) as manifest_file:
+        entry = json.load(manifest_file)["partitions"]["2024-03-02"]
+    assert (entry["rows"], entry["last"]) == (2, "2024-03-02 00:30:00")
@@ -0,0 +1,40 @@
+"""
+Write pipeline: spilled cycles are written in order once the queue drains, a line torn by a power
+cut is skipped, and a full queue under drop_oldest gives up its oldest cycle.
+"""
+
+import os
+import threading
+import time
+from pipeline import WritePipeline
+
+
+def test_corrupt_spill_line_is_skipped(tmp_path):
+    spill_filename = str(tmp_path / "write_queue.spill")
+    with open(spill_filename, 'w') as spill_file:
+        spill_file.write('{"torn\n[1.0, "spilled"]\n')
+    written = []
+    with WritePipeline(written.append, maxsize=1, policy="spill", spill_filename=spill_filename) as pipeline:
+        pipeline.put("queued")
+    assert written == ["spilled", "queued"]
+    assert not os.path.exists(spill_filename)
+
+
+def test_full_queue_drops_the_oldest_cycle():
+    release = threading.Event()
+    written = []
+
+    def consume(item):
+        release.wait()
+        written.append(item)
+
+    with WritePipeline(consume, maxsize=1, policy="drop_oldest") as pipeline:
+        pipeline.put("taken")
+        # Wait for the writer to take the first cycle and block on it
+        while not pipeline.queue.empty():
+            time.sleep(0.01)
+        for item in ["dropped", "kept"]:
+            pipeline.put(item)
+        release.set()
+    assert written == ["taken", "kept"]
+    assert pipeline.dropped == 1
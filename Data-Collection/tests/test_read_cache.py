@@ -0,0 +1,52 @@
+"""
+Read cache: concurrent callers share one hardware read, and only the reads that reach the hardware
+count as attempts in the metrics.
+"""
+
+import functools
+import threading
+import time
+import pytest
+from metrics import SensorMetrics
+from read_cache import ReadCache
+from retry_scheduler import RetryScheduler
+
+
+def test_concurrent_reads_share_one_hardware_read():
+    cache = ReadCache(default_ttl=0)
+    calls = []
+
+    def read():
+        calls.append(1)
+        time.sleep(0.1)
+        return 42
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(cache.get("soil", read))) for _ in range(4)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    assert results == [42] * 4 and len(calls) == 1
+
+
+def test_failed_reads_are_not_cached():
+    cache = ReadCache(default_ttl=60)
+
+    def fail():
+        raise RuntimeError("bus error")
+
+    with pytest.raises(RuntimeError):
+        cache.get("light", fail)
+    assert cache.get("light", lambda: 5.0) == 5.0
+
+
+def test_cache_hits_are_not_timed_as_attempts():
+    metrics = SensorMetrics()
+    cache = ReadCache(default_ttl=60)
+    read = functools.partial(cache.get, "light", metrics.timed("light", lambda: 5.0))
+    scheduler = RetryScheduler(metrics=metrics)
+    for _ in range(3):
+        assert scheduler.run({"light": read})["light"].value == 5.0
+    stats = metrics.stats("light")
+    assert (stats.attempts, stats.reads) == (1, 3)
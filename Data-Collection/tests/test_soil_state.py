@@ -0,0 +1,17 @@
+"""
+Soil state: the journal survives a power cut mid-append, only the torn entry is lost.
+"""
+
+from soil_state import SoilStateStore
+
+
+def test_torn_soil_journal_entry_is_cut_off(tmp_path):
+    filename = str(tmp_path / "soil_state.json")
+    with open(filename + ".journal", 'w') as journal:
+        journal.write("a 10.0\nb 2x\nc 3")
+    store = SoilStateStore(filename)
+    assert store.last_levels == {"a": 10.0}
+    store.update("c", 30.0)
+    store.journal.close()
+
+    assert SoilStateStore(filename).last_levels == {"a": 10.0, "c": 30.0}
@@ -0,0 +1,46 @@
+"""
+Write-ahead log: cycles after the last applied marker are replayed, a torn record is cut off, and
+the log is truncated or compacted as cycles are applied.
+"""
+
+import os
+from wal import WriteAheadLog
+
+
+def test_wal_replays_unapplied_cycles_and_cuts_a_torn_record(tmp_path):
+    filename = str(tmp_path / "readings.wal")
+    with WriteAheadLog(filename, fsync=False) as wal:
+        first = wal.append([["data", "a.csv", {"time": "00:00:00"}]])
+        wal.append([["data", "a.csv", {"time": "00:30:00"}]])
+        # The first cycle was applied, the second is still queued
+        wal.checkpoint(first)
+    with open(filename, 'ab') as file:
+        file.write(b"\x10\x00")
+
+    with WriteAheadLog(filename, fsync=False) as wal:
+        recovered = wal.recover()
+    assert [entries[0][2]["time"] for _, entries in recovered] == ["00:30:00"]
+
+
+def test_wal_checkpoint_truncates_once_everything_is_applied(tmp_path):
+    filename = str(tmp_path / "readings.wal")
+    with WriteAheadLog(filename, fsync=False) as wal:
+        wal.append([["data", "a.csv", {"time": "00:00:00"}]])
+        last = wal.append([["data", "a.csv", {"time": "00:30:00"}]])
+        wal.checkpoint(last)
+    assert os.path.getsize(filename) == 0
+
+
+def test_wal_is_compacted_while_cycles_stay_queued(tmp_path):
+    filename = str(tmp_path / "readings.wal")
+    with WriteAheadLog(filename, fsync=False, compact_bytes=1024) as wal:
+        applied = wal.append([["data", "a.csv", {"time": "00:00:00"}]])
+        for minute in range(1, 60):
+            # The next cycle is always queued when one is applied, the log is never empty
+            queued = wal.append([["data", "a.csv", {"time": f"00:{minute:02d}:00"}]])
+            wal.checkpoint(applied)
+            applied = queued
+        assert os.path.getsize(filename) < 1024 + 100
+    with WriteAheadLog(filename, fsync=False) as wal:
+        recovered = wal.recover()
+    assert [entries[0][2]["time"] for _, entries in recovered] == ["00:59:00"]
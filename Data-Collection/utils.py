@@ -0,0 +1,16 @@
+import datetime
+import logging
+
+
+logger = logging.getLogger("plant-data-collection")
+
+
+def printlog(message):
+    # Print to console and keep a copy in the log
+    print(message)
+    logger.info(message)
+
+
+def row_timestamp(data):
+    # Seconds since the epoch of a row with day and time columns
+    return datetime.datetime.strptime(f"{data['day']} {data['time']}", "%Y-%m-%d %H:%M:%S").timestamp()
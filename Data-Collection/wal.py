@@ -0,0 +1,146 @@
+"""
+Write-Ahead Log
+
+Every cycle's readings are committed to this log (and fsynced) before they are handed to the
+buffered writers. A record is a fixed header (payload length, crc32, sequence number, kind)
+followed by the payload: the rows of the cycle as compact JSON, or the sequence number up to which
+rows have been applied to the data files.
+
+Once the writers have flushed everything durably the log is truncated. When cycles still queued
+for the writers keep it from being truncated, it is rewritten with only those cycles once it grows
+past `compact_bytes`. On startup, records after the last applied marker are replayed; a torn or
+corrupted record ends the log and is cut off.
+"""
+
+import json
+import os
+import struct
+import threading
+import zlib
+from utils import printlog
+
+
+RECORD_HEADER = struct.Struct("<IIQB")
+ROWS = 0
+APPLIED = 1
+
+
+class WriteAheadLog:
+
+
+    def __init__(self, filename, fsync=True, compact_bytes=64 * 1024):
+        self.filename = filename
+        self.fsync = fsync
+        self.compact_bytes = compact_bytes
+        self.sequence = 0
+        self.applied_sequence = 0
+        self.appended_sequence = 0
+        # Cycles are appended by the collection loop and applied on the pipeline thread
+        self.lock = threading.RLock()
+        os.makedirs(os.path.dirname(filename) or ".", exist_ok=True)
+        self.file = open(filename, 'ab')
+
+
+    def __enter__(self):
+        return self
+
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+    def pack_record(self, sequence, kind, payload):
+        checksum = zlib.crc32(struct.pack("<QB", sequence, kind) + payload)
+        return RECORD_HEADER.pack(len(payload), checksum, sequence, kind) + payload
+
+
+    def write_record(self, kind, payload):
+        with self.lock:
+            self.sequence += 1
+            self.file.write(self.pack_record(self.sequence, kind, payload))
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+            return self.sequence
+
+
+    def append(self, entries):
+        # entries: JSON-able rows of one cycle, durable once this returns
+        with self.lock:
+            self.appended_sequence = self.write_record(ROWS, json.dumps(entries, separators=(",", ":")).encode())
+            return self.appended_sequence
+
+
+    def records(self):
+        # (sequence, kind, payload) of every intact record, and the offset where the intact log ends
+        records = []
+        with open(self.filename, 'rb') as file:
+            data = file.read()
+        offset = 0
+        while offset + RECORD_HEADER.size <= len(data):
+            length, checksum, sequence, kind = RECORD_HEADER.unpack_from(data, offset)
+            payload = data[offset + RECORD_HEADER.size:offset + RECORD_HEADER.size + length]
+            if len(payload) != length or zlib.crc32(struct.pack("<QB", sequence, kind) + payload) != checksum:
+                break
+            records.append((sequence, kind, payload))
+            offset += RECORD_HEADER.size + length
+        return records, offset, len(data)
+
+
+    def recover(self):
+        # Entries of every cycle written after the last applied marker, in order
+        records, end, size = self.records()
+        if end != size:
+            printlog(f"Write-ahead log {self.filename}: dropping {size - end} bytes after the last intact record")
+            self.file.truncate(end)
+        for sequence, kind, payload in records:
+            self.sequence = max(self.sequence, sequence)
+            if kind == ROWS:
+                self.appended_sequence = max(self.appended_sequence, sequence)
+            if kind == APPLIED:
+                self.applied_sequence = max(self.applied_sequence, struct.unpack("<Q", payload)[0])
+        return [(sequence, json.loads(payload)) for sequence, kind, payload in records
+                if kind == ROWS and sequence > self.applied_sequence]
+
+
+    def mark_applied(self, sequence=None):
+        # Everything up to sequence is durable in the data files
+        with self.lock:
+            self.applied_sequence = self.sequence if sequence is None else sequence
+            self.write_record(APPLIED, struct.pack("<Q", self.applied_sequence))
+
+
+    def checkpoint(self, sequence=None):
+        # Entries up to sequence (all of them by default) are applied, start the log over if nothing follows
+        with self.lock:
+            self.mark_applied(sequence)
+            if self.applied_sequence < self.appended_sequence:
+                # Cycles appended since are still queued, the marker keeps their place
+                if self.file.tell() >= self.compact_bytes:
+                    self.compact()
+                return
+            self.file.truncate(0)
+            self.file.flush()
+            if self.fsync:
+                os.fsync(self.file.fileno())
+
+
+    def compact(self):
+        # Rewrite the log with only the cycles still to apply, they are replayed from the start
+        with self.lock:
+            records, _, _ = self.records()
+            temp_filename = self.filename + ".tmp"
+            with open(temp_filename, 'wb') as temp_file:
+                for sequence, kind, payload in records:
+                    if kind == ROWS and sequence > self.applied_sequence:
+                        temp_file.write(self.pack_record(sequence, kind, payload))
+                temp_file.flush()
+                if self.fsync:
+                    os.fsync(temp_file.fileno())
+            self.file.close()
+            os.replace(temp_filename, self.filename)
+            self.file = open(self.filename, 'ab')
+
+
+    def close(self):
+        self.file.close()